@@ -0,0 +1,96 @@
+"""In-memory index of booked slots, for answering availability queries.
+
+Each (doctor, date) maps to an int bitmask with one bit per entry in
+``TIME_SLOTS``. The index is built once at startup from the appointments from
+today on (past days are never offered, so their bookings aren't loaded) and
+updated as bookings succeed, so "which slots are free" and "next free slot"
+never touch SQLite: a day is one dict lookup, a month of calendar is ~30.
+
+The index only speeds up reads. The unique slot index in the database is still
+what stops double bookings, so a stale index (e.g. bookings made by another
+worker process) can show a slot as free but can never let it be booked twice.
+"""
+import threading
+from datetime import date, timedelta
+
+DOCTORS = ["Dr. Gregory House", "Dr. Meredith Grey", "Dr. Shaun Murphy"]
+TIME_SLOTS = ["09:00", "10:00", "11:00", "13:00", "14:00", "15:00", "16:00"]
+
+# Longest date range a single availability query may cover
+MAX_RANGE_DAYS = 366
+
+
+class AvailabilityIndex:
+
+    def __init__(self, time_slots=TIME_SLOTS, doctors=DOCTORS):
+        self.time_slots = list(time_slots)
+        self.doctors = frozenset(doctors)
+        self._bits = {slot: 1 << i for i, slot in enumerate(self.time_slots)}
+        self._full = (1 << len(self.time_slots)) - 1
+        self._booked = {}  # (doctor, "YYYY-MM-DD") -> bitmask of booked slots
+        self._lock = threading.Lock()
+
+    def _add(self, booked, rows):
+        for doctor, day, time_slot in rows:
+            bit = self._bits.get(time_slot)
+            if bit:
+                booked[(doctor, day)] = booked.get((doctor, day), 0) | bit
+
+    def load(self, rows):
+        """Rebuild from (doctor, date, time_slot) rows"""
+        booked = {}
+        self._add(booked, rows)
+        with self._lock:
+            self._booked = booked
+
+    async def load_batches(self, batches):
+        """Rebuild from an async iterator of row batches, as the repository streams them,
+        so only one batch is held besides the index itself"""
+        booked = {}
+        async for rows in batches:
+            self._add(booked, rows)
+        with self._lock:
+            self._booked = booked
+
+    def mark_booked(self, doctor, day, time_slot):
+        bit = self._bits.get(time_slot)
+        if not bit:
+            return  # Not one of the offered slots, nothing to track
+        with self._lock:
+            self._booked[(doctor, day)] = self._booked.get((doctor, day), 0) | bit
+
+    def _free_mask(self, doctor, day):
+        if doctor not in self.doctors:
+            return 0  # Nobody to book with, so nothing is free
+        if day < date.today():
+            return 0  # Past days can't be booked, and their bookings aren't loaded
+        return self._full & ~self._booked.get((doctor, day.isoformat()), 0)
+
+    def _slots(self, mask):
+        return [slot for slot in self.time_slots if mask & self._bits[slot]]
+
+    def free_slots(self, doctor, day):
+        return self._slots(self._free_mask(doctor, day))
+
+    def availability(self, doctor, start, end):
+        """Free slots for each day from start to end inclusive"""
+        days = {}
+        day = start
+        while day <= end:
+            days[day.isoformat()] = self.free_slots(doctor, day)
+            day += timedelta(days=1)
+        return days
+
+    def next_available(self, doctor, after, horizon_days=MAX_RANGE_DAYS):
+        """First free (date, time_slot) on or after a day (and today), or None within the horizon"""
+        day = max(after, date.today())
+        for _ in range(horizon_days):
+            mask = self._free_mask(doctor, day)
+            if mask:
+                # Lowest set bit is the earliest free slot of the day
+                return day.isoformat(), self.time_slots[(mask & -mask).bit_length() - 1]
+            day += timedelta(days=1)
+        return None
+
+    def __len__(self):
+        return len(self._booked)
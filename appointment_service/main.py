@@ -1,115 +1,394 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-import sqlite3
-import requests
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, field_validator
+from typing import Optional
 import os
-from datetime import datetime
+import sys
+from datetime import date, datetime, timedelta
 
-app = FastAPI()
+# Make the top-level shared/ package importable when running from this folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.cache import ReadThroughCache, TTLCache
+from shared.clients import ServiceClient, ServiceUnavailable
+from shared.export import MEDIA_TYPES, stream_batches
+from shared.idempotency import IdempotencyMiddleware
+from shared.metrics import instrument
+from shared.pagination import DEFAULT_PAGE_SIZE, MAX_BULK_IDS, MAX_BULK_WRITES, MAX_PAGE_SIZE, set_next_cursor
+from appointment_service.availability import DOCTORS, MAX_RANGE_DAYS, TIME_SLOTS, AvailabilityIndex
+from appointment_service.outbox import BillDispatcher
+from appointment_service.repository import EXPORT_COLUMNS, STARTS_AT_FORMAT, create_repository
 
-# Make sure this matches your patient service port
-PATIENT_SERVICE_URL = "http://127.0.0.1:8001/patients"
-BILLING_SERVICE_URL = "http://127.0.0.1:8003"
+# Make sure this matches your patient service port (or set the env vars)
+PATIENT_SERVICE_URL = os.environ.get("PATIENT_SERVICE_URL", "http://127.0.0.1:8001/patients")
+BILLING_SERVICE_URL = os.environ.get("BILLING_SERVICE_URL", "http://127.0.0.1:8003")
 
-# Get the directory where this file is located
-DB_PATH = os.path.join(os.path.dirname(__file__), 'appointments.db')
+# Pooled keep-alive clients; every call is bounded by a deadline and a circuit breaker
+patient_client = ServiceClient(PATIENT_SERVICE_URL, timeout=2.0)
+billing_client = ServiceClient(BILLING_SERVICE_URL, timeout=5.0)
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    c = conn.cursor()
-    # Added 'time_slot' column
-    c.execute('''CREATE TABLE IF NOT EXISTS appointments 
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT, patient_id INTEGER, doctor TEXT, date TEXT, time_slot TEXT)''')
-    conn.commit()
-    conn.close()
+# Patients are never deleted, so a validated id can be trusted for a long time.
+# Unknown ids are cached only briefly, in case the patient registers right after.
+PATIENT_CACHE_SIZE = int(os.environ.get("PATIENT_CACHE_SIZE", "50000"))
+PATIENT_CACHE_TTL = float(os.environ.get("PATIENT_CACHE_TTL", "3600"))
+PATIENT_MISS_TTL = float(os.environ.get("PATIENT_MISS_TTL", "5"))
+patient_cache = TTLCache(maxsize=PATIENT_CACHE_SIZE, ttl=PATIENT_CACHE_TTL)
 
-init_db()
+# Appointment list pages per patient. Bookings drop that patient's pages; the
+# TTL only bounds staleness from writes made by another worker process.
+HISTORY_CACHE_SIZE = int(os.environ.get("HISTORY_CACHE_SIZE", "10000"))
+HISTORY_CACHE_TTL = float(os.environ.get("HISTORY_CACHE_TTL", "60"))
+history_cache = ReadThroughCache(maxsize=HISTORY_CACHE_SIZE, ttl=HISTORY_CACHE_TTL)
+
+# Get the directory where this file is located (the env var overrides it, e.g. for benchmarks)
+DB_PATH = os.environ.get("APPOINTMENT_DB_PATH", os.path.join(os.path.dirname(__file__), 'appointments.db'))
+# Set to a postgresql:// URL to store appointments in PostgreSQL instead of DB_PATH
+DATABASE_URL = os.environ.get("APPOINTMENT_DATABASE_URL", "")
+repo = create_repository(DATABASE_URL, DB_PATH)
+
+# Sends the bills queued in the outbox to the billing service in the background
+bill_dispatcher = BillDispatcher(repo, billing_client)
+
+# Booked slots per doctor-day, kept in memory for availability queries
+availability = AvailabilityIndex()
+
+@asynccontextmanager
+async def lifespan(app):
+    # Creates the tables on first run and applies any newer migrations
+    await repo.open()
+    # Only today onwards: past days are never offered for booking
+    await availability.load_batches(repo.booked_slots(date.today().isoformat()))
+    bill_dispatcher.start()
+    yield
+    # Close pooled connections cleanly on shutdown
+    await bill_dispatcher.stop()
+    await patient_client.aclose()
+    await billing_client.aclose()
+    await repo.close()
+
+app = FastAPI(lifespan=lifespan)
+# Writes repeated with the same Idempotency-Key header replay the first response
+app.add_middleware(IdempotencyMiddleware)
+# Latency/in-flight metrics on every route, served on /metrics
+instrument(app)
 
 class AppointmentRequest(BaseModel):
     patient_id: int
     doctor: str
-    date: str
+    # Stored as the ISO date and "HH:MM" slot that the range queries and the
+    # one-booking-per-slot index compare on, so nothing else is accepted
+    date: date
     time_slot: str
 
+    @field_validator("doctor")
+    @classmethod
+    def known_doctor(cls, doctor):
+        if doctor not in DOCTORS:
+            raise ValueError(f"doctor must be one of {', '.join(DOCTORS)}")
+        return doctor
+
+    @field_validator("date")
+    @classmethod
+    def not_in_past(cls, day):
+        # Past days are never offered (see AvailabilityIndex), so they can't be booked either
+        if day < date.today():
+            raise ValueError("date can't be in the past")
+        return day
+
+    @field_validator("time_slot")
+    @classmethod
+    def offered_slot(cls, time_slot):
+        if time_slot not in TIME_SLOTS:
+            raise ValueError(f"time_slot must be one of {', '.join(TIME_SLOTS)}")
+        return time_slot
+
+class BulkHistoryRequest(BaseModel):
+    patient_ids: list[int] = Field(max_length=MAX_BULK_IDS)
+
+class BulkAppointmentRequest(BaseModel):
+    appointments: list[AppointmentRequest] = Field(max_length=MAX_BULK_WRITES)
+
+async def patient_exists(patient_id: int) -> bool:
+    """Ask the patient service whether a patient exists, going through the cache"""
+    exists = patient_cache.get(patient_id)
+    if exists is not None:
+        return exists
+
+    response = await patient_client.get(f"/{patient_id}")
+    exists = response.status_code == 200
+    if exists:
+        patient_cache.set(patient_id, True)
+    elif response.status_code == 404:
+        patient_cache.set(patient_id, False, ttl=PATIENT_MISS_TTL)
+    return exists
+
 @app.post("/appointments/")
-def create_appointment(appt: AppointmentRequest):
-    # 1. Check if Patient Exists (Microservice Communication)
-    response = requests.get(f"{PATIENT_SERVICE_URL}/{appt.patient_id}")
-    if response.status_code != 200:
+async def create_appointment(appt: AppointmentRequest):
+    # 1. Check if Patient Exists (Microservice Communication, cached)
+    try:
+        exists = await patient_exists(appt.patient_id)
+    except ServiceUnavailable as e:
+        print(f"ERROR in create_appointment: {str(e)}")
+        raise HTTPException(status_code=503, detail="Patient service unavailable")
+    if not exists:
         raise HTTPException(status_code=400, detail="Patient validation failed")
 
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    c = conn.cursor()
+    # 2. Book it and queue its bill (SQLite is blocking, so keep it off the event loop)
+    day = appt.date.isoformat()
+    booked = await repo.book_slot(appt.patient_id, appt.doctor, day, appt.time_slot)
+    # Either way the slot is taken now (a conflict means our index was behind)
+    availability.mark_booked(appt.doctor, day, appt.time_slot)
 
-    # 2. Check for Conflicts (Same Doctor + Same Date + Same Time)
-    c.execute("""SELECT id FROM appointments 
-                 WHERE doctor=? AND date=? AND time_slot=?""", 
-              (appt.doctor, appt.date, appt.time_slot))
-    
-    if c.fetchone():
-        conn.close()
+    # 3. Nothing inserted means the slot was already taken (Same Doctor + Same Date + Same Time)
+    if not booked:
         raise HTTPException(status_code=400, detail="This slot is already booked!")
-
-    # 3. Book it
-    c.execute("INSERT INTO appointments (patient_id, doctor, date, time_slot) VALUES (?, ?, ?, ?)", 
-              (appt.patient_id, appt.doctor, appt.date, appt.time_slot))
-    conn.commit()
-    conn.close()
+    history_cache.invalidate(appt.patient_id)
     
-    # 4. Automatically generate a bill for this appointment
-    try:
-        requests.post(f"{BILLING_SERVICE_URL}/bills/generate", params={"patient_id": appt.patient_id})
-    except:
-        pass  # Bill generation failed but appointment was successful
+    # 4. A bill for this appointment was queued with the booking; the
+    #    dispatcher delivers it to the billing service in the background
+    bill_dispatcher.notify()
     
     return {"message": "Appointment booked successfully"}
 
+async def existing_patients(patient_ids):
+    """Which of the given patients exist: cache first, then one batched lookup for the rest"""
+    existing = set()
+    unknown = []
+    for patient_id in set(patient_ids):
+        cached = patient_cache.get(patient_id)
+        if cached is None:
+            unknown.append(patient_id)
+        elif cached:
+            existing.add(patient_id)
+
+    if unknown:
+        # A read, so safe to retry even though it's a POST
+        response = await patient_client.post("/batch", json={"ids": unknown}, retry=True)
+        if response.status_code != 200:
+            raise ServiceUnavailable(f"patient batch lookup failed: HTTP {response.status_code}")
+        found = set(response.json()["existing"])
+        for patient_id in unknown:
+            if patient_id in found:
+                patient_cache.set(patient_id, True)
+                existing.add(patient_id)
+            else:
+                patient_cache.set(patient_id, False, ttl=PATIENT_MISS_TTL)
+    return existing
+
+@app.post("/appointments/bulk")
+async def create_appointments_bulk(req: BulkAppointmentRequest):
+    """Book many appointments at once; each item gets its own result"""
+    # 1. Validate every patient with a single batched lookup
+    try:
+        existing = await existing_patients([a.patient_id for a in req.appointments])
+    except ServiceUnavailable as e:
+        print(f"ERROR in create_appointments_bulk: {str(e)}")
+        raise HTTPException(status_code=503, detail="Patient service unavailable")
+
+    results = [None] * len(req.appointments)
+    valid = []
+    for i, appt in enumerate(req.appointments):
+        if appt.patient_id in existing:
+            valid.append(i)
+        else:
+            results[i] = {"index": i, "status": "rejected", "detail": "Patient validation failed"}
+
+    # 2. Book everything that passed in one transaction, queueing the bills with it
+    appts = [req.appointments[i] for i in valid]
+    try:
+        booked = await repo.book_slots([(a.patient_id, a.doctor, a.date.isoformat(), a.time_slot) for a in appts]) if appts else set()
+    except Exception as e:
+        print(f"ERROR in create_appointments_bulk: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    for position, i in enumerate(valid):
+        appt = appts[position]
+        availability.mark_booked(appt.doctor, appt.date.isoformat(), appt.time_slot)
+        if position in booked:
+            results[i] = {"index": i, "status": "booked"}
+        else:
+            results[i] = {"index": i, "status": "rejected", "detail": "This slot is already booked!"}
+
+    if booked:
+        history_cache.invalidate_many(appts[position].patient_id for position in booked)
+        bill_dispatcher.notify()
+    return {"booked": len(booked), "rejected": len(results) - len(booked), "results": results}
+
+# Appointment lists are paged by a "date|id" cursor (see appointment_service.repository)
+def appointment_cursor(row):
+    return f"{row[1]}|{row[3]}"
+
+def parse_cursor(after):
+    try:
+        date, appt_id = after.rsplit("|", 1)
+        return date, int(appt_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def list_appointments(kind, patient_id, response, limit, after):
+    """One page of a patient's appointments, through the per-patient cache.
+
+    past/upcoming include today's date in the cache key, so after midnight
+    they miss and re-split instead of serving yesterday's answer.
+    """
+    after = parse_cursor(after) if after else None
+    today = datetime.now().strftime("%Y-%m-%d") if kind != "history" else None
+    rows = await history_cache.aget_or_load(patient_id, (kind, today, limit, after),
+                                            lambda: repo.list_appointments(kind, patient_id, today, limit, after))
+    set_next_cursor(response, rows, limit, appointment_cursor)
+    return [format_appointment(r) for r in rows]
+
+def format_appointment(r):
+    return {"doctor": r[0], "date": r[1], "time": r[2]}
+
 @app.get("/appointments/history/{patient_id}")
-def get_history(patient_id: int):
+async def get_history(patient_id: int, response: Response,
+                      limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None):
     try:
-        conn = sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute("SELECT doctor, date, time_slot FROM appointments WHERE patient_id=?", (patient_id,))
-        rows = c.fetchall()
-        conn.close()
-        
-        # Format list of dictionaries
-        return [{"doctor": r[0], "date": r[1], "time": r[2]} for r in rows]
+        return await list_appointments("history", patient_id, response, limit, after)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"ERROR in get_history: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+@app.post("/appointments/history/bulk")
+async def get_history_bulk(req: BulkHistoryRequest):
+    """Full history for many patients at once, grouped by patient id"""
+    patient_ids = list(dict.fromkeys(req.patient_ids))
+    try:
+        history = {patient_id: [] for patient_id in patient_ids}
+        for r in await repo.history_for_patients(patient_ids):
+            history[r[3]].append(format_appointment(r))
+        return history
+    except Exception as e:
+        print(f"ERROR in get_history_bulk: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
 @app.get("/appointments/past/{patient_id}")
-def get_past_appointments(patient_id: int):
-    """Get only past appointments (date < today)"""
+async def get_past_appointments(patient_id: int, response: Response,
+                                limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None):
+    """Get only past appointments (date < today), newest first"""
     try:
-        today = datetime.now().strftime("%Y-%m-%d")
-        conn = sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False)
-        c = conn.cursor()
-        c.execute("SELECT doctor, date, time_slot FROM appointments WHERE patient_id=? AND date < ? ORDER BY date DESC", 
-                  (patient_id, today))
-        rows = c.fetchall()
-        conn.close()
-        
-        return [{"doctor": r[0], "date": r[1], "time": r[2]} for r in rows]
+        return await list_appointments("past", patient_id, response, limit, after)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"ERROR in get_past_appointments: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 @app.get("/appointments/upcoming/{patient_id}")
-def get_upcoming_appointments(patient_id: int):
-    """Get only upcoming appointments (date >= today)"""
+async def get_upcoming_appointments(patient_id: int, response: Response,
+                                    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None):
+    """Get only upcoming appointments (date >= today), soonest first"""
     try:
-        today = datetime.now().strftime("%Y-%m-%d")
-        conn = sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False)
-        c = conn.cursor()
-        c.execute("SELECT doctor, date, time_slot FROM appointments WHERE patient_id=? AND date >= ? ORDER BY date ASC", 
-                  (patient_id, today))
-        rows = c.fetchall()
-        conn.close()
-        
-        return [{"doctor": r[0], "date": r[1], "time": r[2]} for r in rows]
+        return await list_appointments("upcoming", patient_id, response, limit, after)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"ERROR in get_upcoming_appointments: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+# Calendar ranges are paged by a "starts_at|id" cursor
+def range_cursor(row):
+    return f"{row[5]}|{row[0]}"
+
+def starts_at_bound(moment):
+    """A range bound as a starts_at value. Appointments start on the minute, so a
+    bound with seconds is rounded up: 09:00:30 still includes 09:00 as an end and
+    excludes it as a start, just as the exact time would."""
+    if moment.second or moment.microsecond:
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    return moment.strftime(STARTS_AT_FORMAT)
+
+@app.get("/appointments/range")
+async def get_appointments_range(response: Response, start: datetime, end: datetime,
+                                 doctor: Optional[str] = None, patient_id: Optional[int] = None,
+                                 limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None):
+    """Appointments starting in [start, end), soonest first, optionally for one doctor and/or patient.
+    start and end take a date (midnight) or a date and time, e.g. a calendar week, in the clinic's local time."""
+    if start.tzinfo is not None or end.tzinfo is not None:
+        raise HTTPException(status_code=400, detail="start and end are local times and can't carry a UTC offset")
+    if end <= start or end - start > timedelta(days=MAX_RANGE_DAYS):
+        raise HTTPException(status_code=400, detail=f"Time range must be positive and at most {MAX_RANGE_DAYS} days")
+    after = parse_cursor(after) if after else None
+    try:
+        rows = await repo.appointments_between(starts_at_bound(start), starts_at_bound(end),
+                                               limit, doctor, patient_id, after)
+    except Exception as e:
+        print(f"ERROR in get_appointments_range: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    set_next_cursor(response, rows, limit, range_cursor)
+    return [{"id": r[0], "patient_id": r[1], "doctor": r[2], "date": r[3], "time": r[4], "starts_at": r[5]}
+            for r in rows]
+
+@app.get("/appointments/utilization")
+async def get_utilization(start: Optional[date] = None, end: Optional[date] = None, doctor: Optional[str] = None):
+    """Share of each doctor's slots booked between start and end (inclusive, default: today only), with per-day counts"""
+    start = start or date.today()
+    end = end or start
+    if end < start or (end - start).days >= MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range must be 1 to {MAX_RANGE_DAYS} days")
+    doctors = [doctor] if doctor else DOCTORS
+    try:
+        rows = await repo.booked_per_day(doctors, start.isoformat(), end.isoformat())
+    except Exception as e:
+        print(f"ERROR in get_utilization: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    capacity = ((end - start).days + 1) * len(TIME_SLOTS)
+    report = {d: {"booked": 0, "capacity": capacity, "days": {}} for d in doctors}
+    for d, day, booked in rows:
+        report[d]["days"][day] = booked
+        report[d]["booked"] += booked
+    for entry in report.values():
+        entry["utilization"] = round(entry["booked"] / capacity, 4)
+    return {"start": start.isoformat(), "end": end.isoformat(), "doctors": report}
+
+@app.get("/appointments/export")
+def export_appointments(fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+                        start: Optional[date] = None, end: Optional[date] = None):
+    """Stream every appointment as NDJSON or CSV, optionally limited to start <= date <= end"""
+    return StreamingResponse(stream_batches(repo.export(start and start.isoformat(), end and end.isoformat()),
+                                            EXPORT_COLUMNS, fmt),
+                             media_type=MEDIA_TYPES[fmt],
+                             headers={"Content-Disposition": f"attachment; filename=appointments.{fmt}"})
+
+@app.get("/doctors")
+def get_doctors():
+    """Doctors and the time slots that can be booked with them"""
+    return {"doctors": DOCTORS, "time_slots": TIME_SLOTS}
+
+def require_doctor(doctor):
+    if doctor not in DOCTORS:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+
+@app.get("/availability")
+def get_availability(doctor: str, start: Optional[date] = None, end: Optional[date] = None):
+    """Free slots per day for a doctor between start and end (inclusive, default: today only)"""
+    require_doctor(doctor)
+    start = start or date.today()
+    end = end or start
+    if end < start or (end - start).days >= MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range must be 1 to {MAX_RANGE_DAYS} days")
+    return {"doctor": doctor, "days": availability.availability(doctor, start, end)}
+
+@app.get("/availability/next")
+def get_next_available(doctor: str, after: Optional[date] = None):
+    """Earliest free slot for a doctor on or after a date (default: today)"""
+    require_doctor(doctor)
+    slot = availability.next_available(doctor, after or date.today())
+    if slot is None:
+        raise HTTPException(status_code=404, detail="No free slot in the next year")
+    return {"doctor": doctor, "date": slot[0], "time_slot": slot[1]}
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    """Hit/miss counters and approximate memory use of the in-process caches"""
+    return {"patients": patient_cache.stats(), "history": history_cache.stats()}
+
+@app.delete("/cache/patients/{patient_id}")
+def invalidate_patient(patient_id: int):
+    """Drop a cached patient lookup, e.g. after the patient record changes"""
+    patient_cache.invalidate(patient_id)
+    return {"message": "Patient cache entry removed"}
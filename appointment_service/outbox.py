@@ -0,0 +1,90 @@
+"""Background dispatcher that drains the bill outbox into the billing service.
+
+Booking writes the appointment and a ``bill_outbox`` row in one transaction and
+returns without waiting on billing. This dispatcher sends pending rows to
+``POST /bills/generate/batch`` in batches and deletes them once billing has
+accepted them. Each row carries an idempotency key, so re-sending a batch after
+a timeout (or from a second worker) never creates a second bill.
+"""
+import asyncio
+import random
+import time
+
+from shared.clients import ServiceUnavailable
+
+
+class BillDispatcher:
+
+    def __init__(self, repo, billing_client, batch_size=100, interval=2.0,
+                 backoff=1.0, max_backoff=300.0):
+        self.repo = repo
+        self.billing_client = billing_client
+        self.batch_size = batch_size
+        self.interval = interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def notify(self):
+        """Wake the dispatcher right away instead of at the next poll"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                sent = await self.dispatch_once()
+            except Exception as e:
+                print(f"ERROR in bill dispatcher: {str(e)}")
+                sent = 0
+            # A full batch means there may be more waiting; otherwise sleep
+            if sent < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def dispatch_once(self):
+        """Send one batch of due outbox rows. Returns how many were delivered."""
+        rows = await self.repo.due_bills(time.time(), self.batch_size)
+        if not rows:
+            return 0
+
+        payload = {"bills": [{"idempotency_key": key, "patient_id": patient_id}
+                             for _, key, patient_id, _ in rows]}
+        try:
+            # Safe to retry: billing dedupes on the idempotency keys
+            response = await self.billing_client.post("/bills/generate/batch", json=payload, retry=True)
+            delivered = response.status_code == 200
+            error = f"HTTP {response.status_code}"
+        except ServiceUnavailable as e:
+            delivered = False
+            error = str(e)
+
+        if delivered:
+            await self.repo.delete_bills([row[0] for row in rows])
+            return len(rows)
+        print(f"ERROR in bill dispatcher: {len(rows)} bills not delivered: {error}")
+        await self._reschedule(rows)
+        return 0
+
+    async def _reschedule(self, rows):
+        now = time.time()
+        updates = []
+        for row_id, _, _, attempts in rows:
+            # Exponential backoff with jitter, capped so a long outage still retries
+            delay = min(self.backoff * 2 ** min(attempts, 16), self.max_backoff) * random.uniform(0.5, 1.0)
+            updates.append((now + delay, row_id))
+        await self.repo.reschedule_bills(updates)
@@ -0,0 +1,307 @@
+"""Storage for appointments and the bill outbox, on SQLite or PostgreSQL (see ``shared.repository``).
+
+Appointments are passed in and out as plain tuples: ``(patient_id, doctor,
+date, time_slot)`` for bookings, ``(doctor, date, time_slot, id)`` for list
+pages and RANGE_COLUMNS for calendar ranges, so both backends return exactly
+the same values.
+"""
+from shared.export import BATCH_SIZE
+from shared.pagination import chunks, placeholders
+from shared.repository import PostgresRepository, SqliteRepository, blocking, is_postgres_url
+from appointment_service.schema import MIGRATIONS, POSTGRES_MIGRATIONS
+
+EXPORT_COLUMNS = ["id", "patient_id", "doctor", "date", "time_slot"]
+RANGE_COLUMNS = ["id", "patient_id", "doctor", "date", "time_slot", "starts_at"]
+# starts_at is date || "T" || time_slot, so it sorts and compares chronologically
+STARTS_AT_FORMAT = "%Y-%m-%dT%H:%M"
+
+# Appointment lists are ordered by (date, id) and paged by a (date, id) cursor,
+# which the (patient_id, date) index serves without sorting.
+# kind -> (extra filter on today, cursor comparison, order)
+LISTS = {
+    "history": ("", ">", "date, id"),
+    "past": ("AND date < {today}", "<", "date DESC, id DESC"),
+    "upcoming": ("AND date >= {today}", ">", "date ASC, id ASC"),
+}
+
+
+# Upcoming bookings for the availability index. The slot index leads with doctor,
+# so a bound on the date alone seeks on the starts_at index instead.
+BOOKED_SLOTS_SQL = "SELECT doctor, date, time_slot FROM appointments WHERE starts_at >= {}"
+
+
+def _list_sql(kind, after, placeholder):
+    """SQL and the order of its parameters for one page of a patient's appointments"""
+    today_filter, comparison, order = LISTS[kind]
+    names = ["patient_id"]
+    sql = f"SELECT doctor, date, time_slot, id FROM appointments WHERE patient_id={placeholder(1)}"
+    if today_filter:
+        names.append("today")
+        sql += " " + today_filter.format(today=placeholder(len(names)))
+    if after:
+        names.extend(["after_date", "after_id"])
+        sql += f" AND (date, id) {comparison} ({placeholder(len(names) - 1)}, {placeholder(len(names))})"
+    names.append("limit")
+    return sql + f" ORDER BY {order} LIMIT {placeholder(len(names))}", names
+
+
+def _range_sql(doctor, patient_id, after, placeholder):
+    """SQL and the order of its parameters for one page of appointments with
+    start <= starts_at < end, ordered and paged by (starts_at, id).
+
+    With a doctor or patient the (doctor, starts_at) or (patient_id, starts_at)
+    index serves the range; without either, the starts_at index does.
+    """
+    names = ["start", "end"]
+    sql = (f"SELECT {', '.join(RANGE_COLUMNS)} FROM appointments "
+           f"WHERE starts_at >= {placeholder(1)} AND starts_at < {placeholder(2)}")
+    if doctor is not None:
+        names.append("doctor")
+        sql += f" AND doctor={placeholder(len(names))}"
+    if patient_id is not None:
+        names.append("patient_id")
+        sql += f" AND patient_id={placeholder(len(names))}"
+    if after:
+        names.extend(["after_starts_at", "after_id"])
+        sql += f" AND (starts_at, id) > ({placeholder(len(names) - 1)}, {placeholder(len(names))})"
+    names.append("limit")
+    return sql + f" ORDER BY starts_at, id LIMIT {placeholder(len(names))}", names
+
+
+def _range_values(start, end, limit, doctor, patient_id, after):
+    values = {"start": start, "end": end, "doctor": doctor, "patient_id": patient_id, "limit": limit}
+    if after:
+        values["after_starts_at"], values["after_id"] = after
+    return values
+
+
+def _export_filters(start, end, placeholder):
+    """WHERE clause and params for start <= date <= end"""
+    clauses = []
+    params = []
+    for op, value in ((">=", start), ("<=", end)):
+        if value:
+            params.append(value)
+            clauses.append(f"date {op} {placeholder(len(params))}")
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+def _booked_positions(appts, inserted):
+    """Map inserted (id, patient_id, doctor, date, time_slot) rows back to the
+    first position in ``appts`` that asked for each slot"""
+    inserted_slots = {(r[2], r[3], r[4]): r[1] for r in inserted}
+    booked = set()
+    for i, (patient_id, doctor, day, time_slot) in enumerate(appts):
+        if inserted_slots.get((doctor, day, time_slot)) == patient_id:
+            booked.add(i)
+            del inserted_slots[(doctor, day, time_slot)]
+    return booked
+
+
+class SqliteAppointmentRepository(SqliteRepository):
+
+    def __init__(self, path, **db_options):
+        super().__init__(path, MIGRATIONS, **db_options)
+
+    @blocking
+    def book_slot(self, patient_id, doctor, day, time_slot):
+        """Book a slot and queue its bill. Returns False if the slot is already taken."""
+        # The unique (doctor, date, time_slot) index makes the insert a no-op if the
+        # slot is taken, so conflict check and write are one atomic statement and
+        # two concurrent requests can never both get the slot
+        with self.db.transaction() as conn:
+            c = conn.execute("""INSERT INTO appointments (patient_id, doctor, date, time_slot) VALUES (?, ?, ?, ?)
+                                ON CONFLICT (doctor, date, time_slot) DO NOTHING""",
+                             (patient_id, doctor, day, time_slot))
+            if c.rowcount != 1:
+                return False
+            # Queue the bill in the same transaction, so it is never lost and never
+            # requested for an appointment that didn't commit
+            conn.execute("INSERT INTO bill_outbox (idempotency_key, patient_id) VALUES (?, ?)",
+                         (f"appointment-{c.lastrowid}", patient_id))
+            return True
+
+    @blocking
+    def book_slots(self, appts):
+        """Book many slots in one transaction. Returns the set of list positions that were booked.
+
+        Same guarantee as book_slot: the upsert skips any slot that is already
+        taken (or repeated earlier in the list). Because BEGIN IMMEDIATE holds the
+        write lock, every id above the previous maximum is one of ours, which tells
+        us which rows went in without a query per item.
+        """
+        with self.db.transaction() as conn:
+            last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM appointments").fetchone()[0]
+            conn.executemany("""INSERT INTO appointments (patient_id, doctor, date, time_slot) VALUES (?, ?, ?, ?)
+                                ON CONFLICT (doctor, date, time_slot) DO NOTHING""", appts)
+            inserted = conn.execute("SELECT id, patient_id, doctor, date, time_slot FROM appointments WHERE id > ?",
+                                    (last_id,)).fetchall()
+            conn.executemany("INSERT INTO bill_outbox (idempotency_key, patient_id) VALUES (?, ?)",
+                             [(f"appointment-{r[0]}", r[1]) for r in inserted])
+        return _booked_positions(appts, inserted)
+
+    @blocking
+    def list_appointments(self, kind, patient_id, today, limit, after=None):
+        """One page of a patient's "history", "past" or "upcoming" appointments.
+        ``after`` is the (date, id) of the last row of the previous page."""
+        sql, names = _list_sql(kind, after, lambda n: "?")
+        values = {"patient_id": patient_id, "today": today, "limit": limit}
+        if after:
+            values["after_date"], values["after_id"] = after
+        with self.db.connection() as conn:
+            return conn.execute(sql, [values[name] for name in names]).fetchall()
+
+    @blocking
+    def appointments_between(self, start, end, limit, doctor=None, patient_id=None, after=None):
+        """One page of RANGE_COLUMNS rows with start <= starts_at < end ("YYYY-MM-DDTHH:MM"),
+        optionally for one doctor and/or patient. ``after`` is the (starts_at, id)
+        of the last row of the previous page."""
+        sql, names = _range_sql(doctor, patient_id, after, lambda n: "?")
+        values = _range_values(start, end, limit, doctor, patient_id, after)
+        with self.db.connection() as conn:
+            return conn.execute(sql, [values[name] for name in names]).fetchall()
+
+    @blocking
+    def booked_per_day(self, doctors, start, end):
+        """(doctor, date, booked slots) for each day with bookings in start <= date <= end"""
+        with self.db.connection() as conn:
+            # Grouped straight off the (doctor, date, time_slot) index, no sort
+            return conn.execute(f"""SELECT doctor, date, COUNT(*) FROM appointments
+                                    WHERE doctor IN ({placeholders(len(doctors))}) AND date >= ? AND date <= ?
+                                    GROUP BY doctor, date ORDER BY doctor, date""",
+                                [*doctors, start, end]).fetchall()
+
+    @blocking
+    def history_for_patients(self, patient_ids):
+        """(doctor, date, time_slot, patient_id) of many patients' appointments, in (date, id) order per chunk"""
+        rows = []
+        with self.db.connection() as conn:
+            for chunk in chunks(patient_ids):
+                c = conn.execute(f"""SELECT doctor, date, time_slot, patient_id FROM appointments
+                                     WHERE patient_id IN ({placeholders(len(chunk))}) ORDER BY date, id""", chunk)
+                rows.extend(c)
+        return rows
+
+    def booked_slots(self, since, batch_size=BATCH_SIZE):
+        """Batches of (doctor, date, time_slot) of the appointments on or after ``since``,
+        for the availability index"""
+        return self.stream(BOOKED_SLOTS_SQL.format("?"), [f"{since}T00:00"], batch_size)
+
+    def export(self, start=None, end=None, batch_size=BATCH_SIZE):
+        """Batches of EXPORT_COLUMNS rows in id order, optionally limited to start <= date <= end"""
+        where, params = _export_filters(start, end, lambda n: "?")
+        return self.stream(f"SELECT {', '.join(EXPORT_COLUMNS)} FROM appointments{where} ORDER BY id",
+                           params, batch_size)
+
+    @blocking
+    def due_bills(self, now, limit):
+        """(id, idempotency_key, patient_id, attempts) of outbox rows due by ``now``, oldest first"""
+        with self.db.connection() as conn:
+            return conn.execute(
+                """SELECT id, idempotency_key, patient_id, attempts FROM bill_outbox
+                   WHERE next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?""",
+                (now, limit)).fetchall()
+
+    @blocking
+    def delete_bills(self, ids):
+        with self.db.transaction() as conn:
+            conn.executemany("DELETE FROM bill_outbox WHERE id=?", [(row_id,) for row_id in ids])
+
+    @blocking
+    def reschedule_bills(self, updates):
+        """Count a failed attempt for each (next_attempt_at, id)"""
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "UPDATE bill_outbox SET attempts = attempts + 1, next_attempt_at=? WHERE id=?", updates)
+
+
+class PostgresAppointmentRepository(PostgresRepository):
+
+    def __init__(self, url, **pool_options):
+        super().__init__(url, "appointments", POSTGRES_MIGRATIONS, **pool_options)
+
+    async def book_slot(self, patient_id, doctor, day, time_slot):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                appointment_id = await conn.fetchval(
+                    """INSERT INTO appointments (patient_id, doctor, date, time_slot) VALUES ($1, $2, $3, $4)
+                       ON CONFLICT (doctor, date, time_slot) DO NOTHING RETURNING id""",
+                    patient_id, doctor, day, time_slot)
+                if appointment_id is None:
+                    return False
+                await conn.execute("INSERT INTO bill_outbox (idempotency_key, patient_id) VALUES ($1, $2)",
+                                   f"appointment-{appointment_id}", patient_id)
+                return True
+
+    async def book_slots(self, appts):
+        columns = list(zip(*appts)) or [[], [], [], []]
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # One statement in list order; RETURNING says exactly which rows went in
+                inserted = await conn.fetch(
+                    """INSERT INTO appointments (patient_id, doctor, date, time_slot)
+                       SELECT patient_id, doctor, date, time_slot
+                       FROM unnest($1::bigint[], $2::text[], $3::text[], $4::text[])
+                            WITH ORDINALITY AS a (patient_id, doctor, date, time_slot, position)
+                       ORDER BY position
+                       ON CONFLICT (doctor, date, time_slot) DO NOTHING
+                       RETURNING id, patient_id, doctor, date, time_slot""",
+                    *[list(column) for column in columns])
+                await conn.execute(
+                    """INSERT INTO bill_outbox (idempotency_key, patient_id)
+                       SELECT 'appointment-' || id, patient_id FROM unnest($1::bigint[], $2::bigint[]) AS o (id, patient_id)""",
+                    [r[0] for r in inserted], [r[1] for r in inserted])
+        return _booked_positions(appts, inserted)
+
+    async def list_appointments(self, kind, patient_id, today, limit, after=None):
+        sql, names = _list_sql(kind, after, lambda n: f"${n}")
+        values = {"patient_id": patient_id, "today": today, "limit": limit}
+        if after:
+            values["after_date"], values["after_id"] = after
+        rows = await self.pool.fetch(sql, *[values[name] for name in names])
+        return [tuple(r) for r in rows]
+
+    async def appointments_between(self, start, end, limit, doctor=None, patient_id=None, after=None):
+        sql, names = _range_sql(doctor, patient_id, after, lambda n: f"${n}")
+        values = _range_values(start, end, limit, doctor, patient_id, after)
+        rows = await self.pool.fetch(sql, *[values[name] for name in names])
+        return [tuple(r) for r in rows]
+
+    async def booked_per_day(self, doctors, start, end):
+        rows = await self.pool.fetch("""SELECT doctor, date, COUNT(*) FROM appointments
+                                        WHERE doctor = ANY($1::text[]) AND date >= $2 AND date <= $3
+                                        GROUP BY doctor, date ORDER BY doctor, date""", list(doctors), start, end)
+        return [tuple(r) for r in rows]
+
+    async def history_for_patients(self, patient_ids):
+        rows = await self.pool.fetch("""SELECT doctor, date, time_slot, patient_id FROM appointments
+                                        WHERE patient_id = ANY($1::bigint[]) ORDER BY date, id""", patient_ids)
+        return [tuple(r) for r in rows]
+
+    def booked_slots(self, since, batch_size=BATCH_SIZE):
+        return self.stream(BOOKED_SLOTS_SQL.format("$1"), [f"{since}T00:00"], batch_size)
+
+    def export(self, start=None, end=None, batch_size=BATCH_SIZE):
+        where, params = _export_filters(start, end, lambda n: f"${n}")
+        return self.stream(f"SELECT {', '.join(EXPORT_COLUMNS)} FROM appointments{where} ORDER BY id",
+                           params, batch_size)
+
+    async def due_bills(self, now, limit):
+        rows = await self.pool.fetch(
+            """SELECT id, idempotency_key, patient_id, attempts FROM bill_outbox
+               WHERE next_attempt_at <= $1 ORDER BY next_attempt_at LIMIT $2""", now, limit)
+        return [tuple(r) for r in rows]
+
+    async def delete_bills(self, ids):
+        await self.pool.execute("DELETE FROM bill_outbox WHERE id = ANY($1::bigint[])", list(ids))
+
+    async def reschedule_bills(self, updates):
+        await self.pool.executemany(
+            "UPDATE bill_outbox SET attempts = attempts + 1, next_attempt_at=$1 WHERE id=$2", updates)
+
+
+def create_repository(url, path):
+    """PostgreSQL if ``url`` is a postgresql:// URL, otherwise the SQLite file at ``path``"""
+    if is_postgres_url(url):
+        return PostgresAppointmentRepository(url)
+    return SqliteAppointmentRepository(path)
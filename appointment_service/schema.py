@@ -0,0 +1,73 @@
+"""Schema migrations for appointments.db (and the PostgreSQL backend). Append new versions; never edit old ones."""
+
+MIGRATIONS = [
+    # 1: original table
+    '''CREATE TABLE IF NOT EXISTS appointments
+       (id INTEGER PRIMARY KEY AUTOINCREMENT, patient_id INTEGER, doctor TEXT, date TEXT, time_slot TEXT);''',
+
+    # 2: a doctor can only hold one appointment per slot, and history/past/upcoming
+    #    are all looked up by patient and ordered by date. The old check-then-insert
+    #    booking could double-book a slot, so the earliest booking of each slot is
+    #    kept and later ones are moved to appointment_conflicts (with the id they
+    #    lost to) for follow-up, e.g. refunding their bills, before the index goes on.
+    '''CREATE TABLE IF NOT EXISTS appointment_conflicts
+       (id INTEGER PRIMARY KEY, patient_id INTEGER, doctor TEXT, date TEXT, time_slot TEXT, kept_id INTEGER);
+       INSERT INTO appointment_conflicts (id, patient_id, doctor, date, time_slot, kept_id)
+       SELECT a.id, a.patient_id, a.doctor, a.date, a.time_slot, k.kept_id
+       FROM appointments a
+       JOIN (SELECT doctor, date, time_slot, MIN(id) AS kept_id FROM appointments
+             GROUP BY doctor, date, time_slot HAVING COUNT(*) > 1) k
+         ON a.doctor = k.doctor AND a.date = k.date AND a.time_slot = k.time_slot
+       WHERE a.id <> k.kept_id;
+       DELETE FROM appointments WHERE id IN (SELECT id FROM appointment_conflicts);
+       CREATE UNIQUE INDEX IF NOT EXISTS idx_appointments_slot ON appointments (doctor, date, time_slot);
+       CREATE INDEX IF NOT EXISTS idx_appointments_patient_date ON appointments (patient_id, date);''',
+
+    # 3: transactional outbox of bills still to be sent to the billing service
+    '''CREATE TABLE IF NOT EXISTS bill_outbox
+       (id INTEGER PRIMARY KEY AUTOINCREMENT, idempotency_key TEXT NOT NULL UNIQUE, patient_id INTEGER NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL DEFAULT 0);
+       CREATE INDEX IF NOT EXISTS idx_bill_outbox_due ON bill_outbox (next_attempt_at);''',
+
+    # 4: date and time_slot combined into one sortable "YYYY-MM-DDTHH:MM" value,
+    #    computed by the database so every write path keeps it right, and indexed
+    #    for calendar range queries by doctor, by patient and across everyone
+    '''ALTER TABLE appointments ADD COLUMN starts_at TEXT GENERATED ALWAYS AS (date || 'T' || time_slot) VIRTUAL;
+       CREATE INDEX IF NOT EXISTS idx_appointments_doctor_starts ON appointments (doctor, starts_at);
+       CREATE INDEX IF NOT EXISTS idx_appointments_patient_starts ON appointments (patient_id, starts_at);
+       CREATE INDEX IF NOT EXISTS idx_appointments_starts ON appointments (starts_at);''',
+]
+
+# PostgreSQL starts from the current shape of the schema above; later changes
+# get appended to both lists.
+POSTGRES_MIGRATIONS = [
+    # 1: appointments with one booking per slot, plus the bill outbox. Duplicate
+    #    slots in a pre-existing table are moved aside as in version 2 above.
+    '''CREATE TABLE IF NOT EXISTS appointments
+       (id BIGSERIAL PRIMARY KEY, patient_id BIGINT, doctor TEXT, date TEXT, time_slot TEXT);
+       CREATE TABLE IF NOT EXISTS appointment_conflicts
+       (id BIGINT PRIMARY KEY, patient_id BIGINT, doctor TEXT, date TEXT, time_slot TEXT, kept_id BIGINT);
+       INSERT INTO appointment_conflicts (id, patient_id, doctor, date, time_slot, kept_id)
+       SELECT a.id, a.patient_id, a.doctor, a.date, a.time_slot, k.kept_id
+       FROM appointments a
+       JOIN (SELECT doctor, date, time_slot, MIN(id) AS kept_id FROM appointments
+             GROUP BY doctor, date, time_slot HAVING COUNT(*) > 1) k
+         ON a.doctor = k.doctor AND a.date = k.date AND a.time_slot = k.time_slot
+       WHERE a.id <> k.kept_id;
+       DELETE FROM appointments WHERE id IN (SELECT id FROM appointment_conflicts);
+       CREATE UNIQUE INDEX IF NOT EXISTS idx_appointments_slot ON appointments (doctor, date, time_slot);
+       CREATE INDEX IF NOT EXISTS idx_appointments_patient_date ON appointments (patient_id, date);
+       CREATE TABLE IF NOT EXISTS bill_outbox
+       (id BIGSERIAL PRIMARY KEY, idempotency_key TEXT NOT NULL UNIQUE, patient_id BIGINT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at DOUBLE PRECISION NOT NULL DEFAULT 0);
+       CREATE INDEX IF NOT EXISTS idx_bill_outbox_due ON bill_outbox (next_attempt_at);''',
+
+    # 2: combined start time for range queries (as version 4 above). id is part of
+    #    each index here, since PostgreSQL indexes don't carry the row id the way
+    #    SQLite's do, so (starts_at, id) pages come off the index without a sort
+    '''ALTER TABLE appointments ADD COLUMN IF NOT EXISTS starts_at TEXT
+           GENERATED ALWAYS AS (date || 'T' || time_slot) STORED;
+       CREATE INDEX IF NOT EXISTS idx_appointments_doctor_starts ON appointments (doctor, starts_at, id);
+       CREATE INDEX IF NOT EXISTS idx_appointments_patient_starts ON appointments (patient_id, starts_at, id);
+       CREATE INDEX IF NOT EXISTS idx_appointments_starts ON appointments (starts_at, id);''',
+]
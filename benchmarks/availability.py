@@ -0,0 +1,63 @@
+"""Latency of availability queries against the in-memory slot index.
+
+Builds an index over ``--days`` of calendar for every doctor with ``--fill`` of
+the slots booked, then times "next available slot" and month-long availability
+queries.
+
+    python benchmarks/availability.py --days 365 --fill 0.95
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from appointment_service.availability import DOCTORS, TIME_SLOTS, AvailabilityIndex
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--fill", type=float, default=0.95)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    first_day = date.today()
+    rows = [(doctor, (first_day + timedelta(days=d)).isoformat(), slot)
+            for doctor in DOCTORS for d in range(args.days) for slot in TIME_SLOTS
+            if random.random() < args.fill]
+
+    index = AvailabilityIndex()
+    start = time.perf_counter()
+    index.load(rows)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    # Worst case: a doctor with every slot booked, so the search walks the whole horizon
+    full = AvailabilityIndex()
+    full.load((DOCTORS[0], (first_day + timedelta(days=d)).isoformat(), slot)
+              for d in range(366) for slot in TIME_SLOTS)
+
+    doctor = DOCTORS[0]
+    month_end = first_day + timedelta(days=30)
+    print(json.dumps({
+        "days": args.days,
+        "booked_slots": len(rows),
+        "build_ms": round(build_ms, 2),
+        "next_available_us": round(timed(lambda: index.next_available(doctor, first_day), args.repeat), 2),
+        "month_availability_us": round(timed(lambda: index.availability(doctor, first_day, month_end), args.repeat), 2),
+        "next_available_fully_booked_us": round(timed(lambda: full.next_available(doctor, first_day), 200), 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
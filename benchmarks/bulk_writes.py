@@ -0,0 +1,107 @@
+"""Rows/sec of the bulk booking and payment endpoints against the per-item ones.
+
+Needs the patient, appointment and billing services running (see --*-url).
+Registers a patient, books ``--rows`` appointments one request at a time and
+then the same number through ``/appointments/bulk``, and does the same for
+paying the resulting bills through ``/bills/pay`` and ``/bills/pay/bulk``.
+
+    python benchmarks/bulk_writes.py --rows 2000 --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from appointment_service.availability import DOCTORS, TIME_SLOTS
+
+
+def unique_slots(count, year):
+    """Distinct (doctor, date, time_slot) triples in a far-future year nobody books"""
+    slots = [(doctor, f"{year}-{month:02d}-{day:02d}", slot)
+             for month in range(1, 13) for day in range(1, 29)
+             for doctor in DOCTORS for slot in TIME_SLOTS]
+    if count > len(slots):
+        raise SystemExit(f"--rows can be at most {len(slots)}")
+    return random.sample(slots, count)
+
+
+async def gather_limited(coros, limit):
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+    return await asyncio.gather(*(run(c) for c in coros))
+
+
+async def wait_for_bills(client, billing_url, patient_id, expected):
+    """Bills arrive through the appointment service's outbox; wait for all of them"""
+    for _ in range(300):
+        r = await client.post(f"{billing_url}/bills/bulk", json={"patient_ids": [patient_id], "status": "PENDING"})
+        bills = r.json()[str(patient_id)]
+        if len(bills) >= expected:
+            return [b["id"] for b in bills]
+        await asyncio.sleep(0.2)
+    raise SystemExit(f"only {len(bills)} of {expected} bills arrived")
+
+
+async def run(args):
+    async with httpx.AsyncClient(timeout=60) as client:
+        r = await client.post(f"{args.patient_url}/register",
+                              json={"name": f"bench-{random.random()}", "age": 40, "password": "bench"})
+        patient_id = r.json()["id"]
+        year = random.randint(3000, 9000)
+        per_item_slots = unique_slots(args.rows, year)
+        bulk_slots = unique_slots(args.rows, year + 1)
+
+        def payload(slot):
+            return {"patient_id": patient_id, "doctor": slot[0], "date": slot[1], "time_slot": slot[2]}
+
+        report = {"rows": args.rows, "concurrency": args.concurrency}
+
+        start = time.perf_counter()
+        await gather_limited([client.post(f"{args.appointment_url}/appointments/", json=payload(s))
+                              for s in per_item_slots], args.concurrency)
+        report["booking_per_item_rows_per_sec"] = round(args.rows / (time.perf_counter() - start), 1)
+
+        start = time.perf_counter()
+        for i in range(0, args.rows, args.batch):
+            await client.post(f"{args.appointment_url}/appointments/bulk",
+                              json={"appointments": [payload(s) for s in bulk_slots[i:i + args.batch]]})
+        report["booking_bulk_rows_per_sec"] = round(args.rows / (time.perf_counter() - start), 1)
+
+        bill_ids = await wait_for_bills(client, args.billing_url, patient_id, 2 * args.rows)
+        per_item_bills, bulk_bills = bill_ids[:args.rows], bill_ids[args.rows:2 * args.rows]
+
+        start = time.perf_counter()
+        await gather_limited([client.post(f"{args.billing_url}/bills/pay", json={"bill_id": b})
+                              for b in per_item_bills], args.concurrency)
+        report["payment_per_item_rows_per_sec"] = round(args.rows / (time.perf_counter() - start), 1)
+
+        start = time.perf_counter()
+        for i in range(0, args.rows, args.batch):
+            await client.post(f"{args.billing_url}/bills/pay/bulk", json={"bill_ids": bulk_bills[i:i + args.batch]})
+        report["payment_bulk_rows_per_sec"] = round(args.rows / (time.perf_counter() - start), 1)
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--patient-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--appointment-url", default="http://127.0.0.1:8002")
+    parser.add_argument("--billing-url", default="http://127.0.0.1:8003")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Calendar range queries over a year of densely booked schedules.
+
+Books every slot of ``--doctors`` doctors for ``--days`` days through the
+appointment repository, then times the queries behind ``/appointments/range``
+and ``/appointments/utilization`` with random windows: a doctor's week and
+month, a patient's year, every doctor for one day, and a month of utilization.
+Each range query is also timed with the window written on
+``date || 'T' || time_slot``, as range filters had to be before the indexed
+``starts_at`` column, to show what the index buys. Prints p50/p95 in ms.
+
+    python benchmarks/calendar_range.py --doctors 100 --days 365
+    python benchmarks/calendar_range.py --url postgresql://postgres@localhost/postgres
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fastapi.concurrency import run_in_threadpool
+from shared.pagination import MAX_PAGE_SIZE
+from appointment_service.availability import TIME_SLOTS
+from appointment_service.repository import RANGE_COLUMNS, PostgresAppointmentRepository, SqliteAppointmentRepository
+
+SEED_BATCH = 5000
+FIRST_DAY = date(2030, 1, 1)
+
+
+def day(offset):
+    return (FIRST_DAY + timedelta(days=offset)).isoformat()
+
+
+async def seed(repo, doctors, days, patients, rng):
+    rows = ((rng.randrange(1, patients + 1), doctor, day(d), slot)
+            for d in range(days) for doctor in doctors for slot in TIME_SLOTS)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == SEED_BATCH:
+            await repo.book_slots(batch)
+            batch = []
+    if batch:
+        await repo.book_slots(batch)
+
+
+async def fetch_unindexed(repo, postgres, start, end, doctor, patient_id, limit):
+    """The same range, filtered on the expression instead of the indexed column"""
+    params = [start, end]
+    sql = (f"SELECT {', '.join(RANGE_COLUMNS)} FROM appointments "
+           "WHERE date || 'T' || time_slot >= {} AND date || 'T' || time_slot < {}")
+    for column, value in (("doctor", doctor), ("patient_id", patient_id)):
+        if value is not None:
+            params.append(value)
+            sql += f" AND {column}={{}}"
+    params.append(limit)
+    sql += " ORDER BY date || 'T' || time_slot, id LIMIT {}"
+    sql = sql.format(*(f"${n}" if postgres else "?" for n in range(1, len(params) + 1)))
+    if postgres:
+        return await repo.pool.fetch(sql, *params)
+
+    def run():
+        with repo.db.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+    return await run_in_threadpool(run)
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {"p50_ms": ms(statistics.median(samples)), "p95_ms": ms(samples[int(len(samples) * 0.95) - 1])}
+
+
+async def postgres_schema(url, statement):
+    import asyncpg
+    conn = await asyncpg.connect(url)
+    try:
+        await conn.execute(statement)
+    finally:
+        await conn.close()
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    doctors = [f"Dr. {i:03d}" for i in range(args.doctors)]
+    postgres = bool(args.url)
+    # PostgreSQL runs get a throwaway schema, dropped afterwards
+    schema = f"calendar_bench_{uuid.uuid4().hex[:12]}"
+    with tempfile.TemporaryDirectory() as tmp:
+        if postgres:
+            await postgres_schema(args.url, f"CREATE SCHEMA {schema}")
+            repo = PostgresAppointmentRepository(args.url, server_settings={"search_path": schema})
+        else:
+            repo = SqliteAppointmentRepository(os.path.join(tmp, "appointments.db"))
+        await repo.open()
+        start = time.perf_counter()
+        await seed(repo, doctors, args.days, args.patients, rng)
+        seed_seconds = time.perf_counter() - start
+        if postgres:
+            await repo.pool.execute("ANALYZE appointments")
+
+        def window(days):
+            first = rng.randrange(0, max(1, args.days - days))
+            return f"{day(first)}T00:00", f"{day(first + days)}T00:00"
+
+        # name -> (window length in days, doctor?, patient?)
+        ranges = {
+            "doctor_week": (7, True, False),
+            "doctor_month": (30, True, False),
+            "patient_year": (args.days, False, True),
+            "all_doctors_day": (1, False, False),
+        }
+        report = {}
+        for name, (days, by_doctor, by_patient) in ranges.items():
+            indexed, unindexed, rows = [], [], 0
+            for _ in range(args.repeat):
+                start_at, end_at = window(days)
+                doctor = rng.choice(doctors) if by_doctor else None
+                patient_id = rng.randrange(1, args.patients + 1) if by_patient else None
+                t = time.perf_counter()
+                page = await repo.appointments_between(start_at, end_at, MAX_PAGE_SIZE, doctor, patient_id)
+                indexed.append(time.perf_counter() - t)
+                rows += len(page)
+                t = time.perf_counter()
+                await fetch_unindexed(repo, postgres, start_at, end_at, doctor, patient_id, MAX_PAGE_SIZE)
+                unindexed.append(time.perf_counter() - t)
+            report[name] = {"rows_per_query": round(rows / args.repeat, 1),
+                            "indexed": summarize(indexed), "unindexed": summarize(unindexed)}
+
+        samples = []
+        for _ in range(args.repeat):
+            first = rng.randrange(0, max(1, args.days - 30))
+            t = time.perf_counter()
+            await repo.booked_per_day(doctors, day(first), day(first + 29))
+            samples.append(time.perf_counter() - t)
+        report["utilization_month"] = summarize(samples)
+        await repo.close()
+        if postgres:
+            await postgres_schema(args.url, f"DROP SCHEMA {schema} CASCADE")
+
+    print(json.dumps({
+        "backend": "postgresql" if postgres else "sqlite",
+        "appointments": args.doctors * args.days * len(TIME_SLOTS),
+        "seed_seconds": round(seed_seconds, 2),
+        "queries": report,
+    }, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--doctors", type=int, default=100)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--patients", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=50, help="queries timed per kind")
+    parser.add_argument("--url", default="", help="postgresql:// URL to benchmark instead of SQLite")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Export throughput and memory at large table sizes.
+
+Seeds a temporary bills table with ``--rows`` rows (10M by default), then
+drains the billing repository's ``export()`` through ``stream_batches``, the
+same path ``/bills/export`` streams, and reports rows/sec, MB/sec and how much
+peak memory grew while streaming.
+
+    python benchmarks/export_throughput.py --rows 10000000 --format ndjson
+    python benchmarks/export_throughput.py --url postgresql://postgres@localhost/postgres
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.export import stream_batches
+from billing_service.repository import EXPORT_COLUMNS, PostgresBillRepository, SqliteBillRepository
+
+SEED_BATCH = 100000
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux. With SQLite it also counts database pages mapped
+    # through SQLITE_MMAP_SIZE, so growth is bounded by that setting plus one batch.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bill_rows(start, count):
+    return [(i % 50000, 150.0, "PAID" if i % 3 else "PENDING", f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}")
+            for i in range(start, start + count)]
+
+
+async def seed(repo, postgres, rows):
+    """Bulk-insert bills straight into the table; export reads nothing else"""
+    columns = ["patient_id", "amount", "status", "date_generated"]
+    for start in range(0, rows, SEED_BATCH):
+        batch = bill_rows(start, min(SEED_BATCH, rows - start))
+        if postgres:
+            await repo.pool.copy_records_to_table("bills", records=batch, columns=columns)
+        else:
+            with repo.db.transaction() as conn:
+                conn.executemany("INSERT INTO bills (patient_id, amount, status, date_generated) VALUES (?, ?, ?, ?)",
+                                 batch)
+
+
+async def postgres_schema(url, statement):
+    import asyncpg
+    conn = await asyncpg.connect(url)
+    try:
+        await conn.execute(statement)
+    finally:
+        await conn.close()
+
+
+async def run(args):
+    postgres = bool(args.url)
+    # PostgreSQL runs get a throwaway schema, dropped afterwards
+    schema = f"export_bench_{uuid.uuid4().hex[:12]}"
+    with tempfile.TemporaryDirectory() as tmp:
+        if postgres:
+            await postgres_schema(args.url, f"CREATE SCHEMA {schema}")
+            repo = PostgresBillRepository(args.url, server_settings={"search_path": schema})
+        else:
+            repo = SqliteBillRepository(os.path.join(tmp, "billing.db"))
+        await repo.open()
+        start = time.perf_counter()
+        await seed(repo, postgres, args.rows)
+        seed_seconds = time.perf_counter() - start
+
+        rss_before = peak_rss_mb()
+        total_bytes = 0
+        start = time.perf_counter()
+        async for chunk in stream_batches(repo.export(), EXPORT_COLUMNS, args.format):
+            total_bytes += len(chunk)
+        elapsed = time.perf_counter() - start
+        rss_growth = peak_rss_mb() - rss_before
+        await repo.close()
+        if postgres:
+            await postgres_schema(args.url, f"DROP SCHEMA {schema} CASCADE")
+
+    print(json.dumps({
+        "backend": "postgresql" if postgres else "sqlite",
+        "rows": args.rows,
+        "format": args.format,
+        "seed_seconds": round(seed_seconds, 2),
+        "export_seconds": round(elapsed, 2),
+        "rows_per_sec": round(args.rows / elapsed),
+        "mb_per_sec": round(total_bytes / elapsed / 1e6, 1),
+        "exported_mb": round(total_bytes / 1e6, 1),
+        "peak_rss_growth_mb": round(rss_growth, 1),
+    }, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--url", default="", help="postgresql:// URL to benchmark instead of SQLite")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
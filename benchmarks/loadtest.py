@@ -0,0 +1,295 @@
+"""Reproducible load test of the patient, appointment and billing services.
+
+Boots all three services locally on temporary databases, seeds them with the
+requested volumes, then drives a mixed workload (logins, booking storms on a
+few hot slots, history reads, bill reads and payments) from concurrent clients.
+Prints a JSON report with throughput, p50/p95/p99 latency and error rates per
+operation, tagged with the current commit so runs can be compared.
+
+    python benchmarks/loadtest.py --patients 10000 --appointments 200000 --bills 200000 \\
+        --duration 30 --concurrency 64 --output results.json
+
+Requests answered with 4xx (e.g. a slot that is already taken) count as
+"rejected"; only 5xx responses and transport errors count as errors.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from shared.migrations import migrate
+from patient_service.passwords import hash_password
+from patient_service.schema import MIGRATIONS as PATIENT_MIGRATIONS
+from appointment_service.availability import DOCTORS, TIME_SLOTS
+from appointment_service.schema import MIGRATIONS as APPOINTMENT_MIGRATIONS
+from billing_service.schema import MIGRATIONS as BILLING_MIGRATIONS
+
+PASSWORD = "loadtest"
+DEFAULT_MIX = "login=1,book=3,history=4,bills=2,pay=1"
+# At most this share of the seeded calendar is booked; more doctors are added to keep it so
+SEED_FILL = 0.5
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def seed_database(path, migrations, sql, rows):
+    conn = sqlite3.connect(path)
+    migrate(conn, migrations)
+    with conn:
+        conn.executemany(sql, rows)
+    conn.close()
+
+
+def seed(tmp, args, rng):
+    """Write the three databases directly; much faster than going through the APIs"""
+    # Every patient shares one hash, so seeding doesn't pay for the KDF per row
+    password_hash = hash_password(PASSWORD, args.kdf_iterations)
+    seed_database(os.path.join(tmp, "patients.db"), PATIENT_MIGRATIONS,
+                  "INSERT INTO patients (id, name, age, password) VALUES (?, ?, ?, ?)",
+                  ((i, f"patient{i}", rng.randint(1, 90), password_hash) for i in range(1, args.patients + 1)))
+
+    # Distinct slots over the year that ends just before the booking storm's week
+    # (see Workload), drawn without replacement from every (doctor, day, slot)
+    first_day = date.today() - timedelta(days=335)
+    per_doctor = 365 * len(TIME_SLOTS)
+    extra = max(0, math.ceil(args.appointments / (per_doctor * SEED_FILL)) - len(DOCTORS))
+    doctors = list(DOCTORS) + [f"Dr. Seed {i:04d}" for i in range(extra)]
+
+    def slot(position):
+        doctor, rest = divmod(position, per_doctor)
+        day, time_slot = divmod(rest, len(TIME_SLOTS))
+        return doctors[doctor], (first_day + timedelta(days=day)).isoformat(), TIME_SLOTS[time_slot]
+
+    positions = rng.sample(range(len(doctors) * per_doctor), args.appointments)
+    seed_database(os.path.join(tmp, "appointments.db"), APPOINTMENT_MIGRATIONS,
+                  "INSERT INTO appointments (patient_id, doctor, date, time_slot) VALUES (?, ?, ?, ?)",
+                  ((rng.randint(1, args.patients),) + slot(position) for position in positions))
+
+    seed_database(os.path.join(tmp, "billing.db"), BILLING_MIGRATIONS,
+                  "INSERT INTO bills (patient_id, amount, status, date_generated) VALUES (?, ?, ?, ?)",
+                  ((rng.randint(1, args.patients), 150.0, rng.choice(["PENDING", "PAID"]),
+                    (first_day + timedelta(days=rng.randrange(365))).isoformat())
+                   for _ in range(args.bills)))
+
+
+def start_services(tmp, args):
+    ports = {name: free_port() for name in ("patient", "appointment", "billing")}
+    env = dict(os.environ,
+               PATIENT_DB_PATH=os.path.join(tmp, "patients.db"),
+               APPOINTMENT_DB_PATH=os.path.join(tmp, "appointments.db"),
+               BILLING_DB_PATH=os.path.join(tmp, "billing.db"),
+               PATIENT_SERVICE_URL=f"http://127.0.0.1:{ports['patient']}/patients",
+               BILLING_SERVICE_URL=f"http://127.0.0.1:{ports['billing']}",
+               PASSWORD_HASH_ITERATIONS=str(args.kdf_iterations))
+    processes = []
+    for name, port in ports.items():
+        log = open(os.path.join(tmp, f"{name}.log"), "w")
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+             "--workers", str(args.workers), "--log-level", "warning"],
+            cwd=os.path.join(ROOT, f"{name}_service"), env=env, stdout=log, stderr=subprocess.STDOUT))
+
+    urls = {name: f"http://127.0.0.1:{port}" for name, port in ports.items()}
+    deadline = time.monotonic() + 30
+    for name, url in urls.items():
+        while True:
+            try:
+                if httpx.get(f"{url}/metrics", timeout=1).status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                stop_services(processes)
+                raise SystemExit(f"{name} service did not start; see {tmp}/{name}.log")
+            time.sleep(0.1)
+    return urls, processes
+
+
+def stop_services(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait(timeout=10)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return round(sorted_values[index] * 1000, 2)
+
+
+class Workload:
+
+    def __init__(self, urls, args, rng):
+        self.urls = urls
+        self.args = args
+        self.rng = rng
+        self.stats = {}
+        ops, weights = zip(*((op, float(w)) for op, w in (part.split("=") for part in args.mix.split(","))))
+        self.ops = ops
+        self.weights = weights
+        # A booking storm: most bookings fight over these few slots
+        first_day = date.today() + timedelta(days=30)
+        self.hot_slots = [(rng.choice(DOCTORS), (first_day + timedelta(days=rng.randrange(7))).isoformat(),
+                           rng.choice(TIME_SLOTS)) for _ in range(args.hot_slots)]
+
+    def patient_id(self):
+        return self.rng.randint(1, self.args.patients)
+
+    def request_for(self, op):
+        pid = self.patient_id()
+        if op == "login":
+            return "POST", f"{self.urls['patient']}/login", {"json": {"name": f"patient{pid}", "password": PASSWORD}}
+        if op == "book":
+            if self.rng.random() < self.args.hot_fraction:
+                doctor, day, slot = self.rng.choice(self.hot_slots)
+            else:
+                doctor, slot = self.rng.choice(DOCTORS), self.rng.choice(TIME_SLOTS)
+                day = (date.today() + timedelta(days=self.rng.randrange(1, 3650))).isoformat()
+            body = {"patient_id": pid, "doctor": doctor, "date": day, "time_slot": slot}
+            return "POST", f"{self.urls['appointment']}/appointments/", {"json": body}
+        if op == "history":
+            kind = self.rng.choice(["history", "past", "upcoming"])
+            return "GET", f"{self.urls['appointment']}/appointments/{kind}/{pid}", {}
+        if op == "bills":
+            kind = self.rng.choice(["pending/", "paid/", ""])
+            return "GET", f"{self.urls['billing']}/bills/{kind}{pid}", {}
+        if op == "pay":
+            bill_id = self.rng.randint(1, max(1, self.args.bills))
+            return "POST", f"{self.urls['billing']}/bills/pay", {"json": {"bill_id": bill_id}}
+        raise SystemExit(f"Unknown operation in --mix: {op}")
+
+    def record(self, op, seconds, outcome):
+        stats = self.stats.setdefault(op, {"latencies": [], "ok": 0, "rejected": 0, "errors": 0})
+        stats["latencies"].append(seconds)
+        stats[outcome] += 1
+
+    async def worker(self, client, deadline):
+        while time.monotonic() < deadline:
+            op = self.rng.choices(self.ops, self.weights)[0]
+            method, url, kwargs = self.request_for(op)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                outcome = "ok" if response.status_code < 400 else "rejected" if response.status_code < 500 else "errors"
+            except httpx.HTTPError:
+                outcome = "errors"
+            self.record(op, time.perf_counter() - start, outcome)
+
+    async def run(self):
+        limits = httpx.Limits(max_connections=self.args.concurrency)
+        async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+            if self.args.warmup:
+                await asyncio.gather(*(self.worker(client, time.monotonic() + self.args.warmup)
+                                       for _ in range(self.args.concurrency)))
+                self.stats = {}
+            start = time.monotonic()
+            await asyncio.gather(*(self.worker(client, start + self.args.duration)
+                                   for _ in range(self.args.concurrency)))
+            return time.monotonic() - start
+
+    def report(self, elapsed):
+        operations = {}
+        all_latencies = []
+        totals = {"ok": 0, "rejected": 0, "errors": 0}
+        for op, stats in sorted(self.stats.items()):
+            latencies = sorted(stats.pop("latencies"))
+            all_latencies.extend(latencies)
+            count = len(latencies)
+            for key in totals:
+                totals[key] += stats[key]
+            operations[op] = {
+                "requests": count,
+                "throughput_rps": round(count / elapsed, 1),
+                "p50_ms": percentile(latencies, 0.50),
+                "p95_ms": percentile(latencies, 0.95),
+                "p99_ms": percentile(latencies, 0.99),
+                **stats,
+                "error_rate": round(stats["errors"] / count, 4) if count else 0.0,
+            }
+        all_latencies.sort()
+        count = len(all_latencies)
+        return {
+            "requests": count,
+            "throughput_rps": round(count / elapsed, 1),
+            "p50_ms": percentile(all_latencies, 0.50),
+            "p95_ms": percentile(all_latencies, 0.95),
+            "p99_ms": percentile(all_latencies, 0.99),
+            **totals,
+            "error_rate": round(totals["errors"] / count, 4) if count else 0.0,
+            "operations": operations,
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--appointments", type=int, default=20000)
+    parser.add_argument("--bills", type=int, default=20000)
+    parser.add_argument("--duration", type=float, default=20, help="seconds of measured load")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds of unmeasured load first")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent client loops")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers per service")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operation weights, e.g. " + DEFAULT_MIX)
+    parser.add_argument("--hot-slots", type=int, default=20)
+    parser.add_argument("--hot-fraction", type=float, default=0.8, help="share of bookings aimed at hot slots")
+    parser.add_argument("--kdf-iterations", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        seed(tmp, args, rng)
+        seed_seconds = time.perf_counter() - start
+
+        urls, processes = start_services(tmp, args)
+        try:
+            workload = Workload(urls, args, rng)
+            elapsed = asyncio.run(workload.run())
+        finally:
+            stop_services(processes)
+
+    report = {
+        "commit": git_commit(),
+        "config": vars(args),
+        "seed_seconds": round(seed_seconds, 2),
+        "duration_seconds": round(elapsed, 2),
+        **workload.report(elapsed),
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
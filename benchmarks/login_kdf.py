@@ -0,0 +1,59 @@
+"""Login throughput at different password-hashing cost settings.
+
+For each PBKDF2 iteration count, verifies a burst of concurrent logins through
+the same bounded ``PasswordHasher`` pool the patient service uses, and reports
+logins/sec with and without the verified-login cache.
+
+    python benchmarks/login_kdf.py --logins 200 --workers 4 --iterations 50000 100000 200000 600000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.cache import TTLCache
+from patient_service.passwords import PasswordHasher, hash_password
+
+
+async def measure(iterations, logins, workers):
+    hasher = PasswordHasher(workers=workers, iterations=iterations)
+    stored = hash_password("correct horse", iterations)
+    cache = TTLCache()
+
+    async def login(cached):
+        if cached and cache.get("user"):
+            return True
+        ok = await hasher.verify("correct horse", stored)
+        cache.set("user", ok)
+        return ok
+
+    results = {}
+    for label, cached in (("uncached", False), ("cached", True)):
+        cache.clear()
+        if cached:
+            # The first login pays for the KDF and fills the cache
+            await login(cached)
+        start = time.perf_counter()
+        await asyncio.gather(*(login(cached) for _ in range(logins)))
+        elapsed = time.perf_counter() - start
+        results[f"{label}_logins_per_sec"] = round(logins / elapsed, 1)
+    hasher.shutdown()
+    return {"iterations": iterations, "workers": workers, "logins": logins, **results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--iterations", type=int, nargs="+", default=[50000, 100000, 200000, 600000])
+    args = parser.parse_args()
+
+    report = [asyncio.run(measure(n, args.logins, args.workers)) for n in args.iterations]
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
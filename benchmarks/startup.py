@@ -0,0 +1,165 @@
+"""Startup time of each service, as a freshly forked or autoscaled worker sees it.
+
+For every service, starts new Python processes that import ``main`` the way
+uvicorn does, run the lifespan startup (migrations, pools, caches) and serve
+one request straight through the ASGI app, timing each step. The first run of
+a service starts on an empty database; the remaining ``--runs`` start on the
+now-current schema, which is the usual case when workers are added. Then the
+appointment service is started again on a table seeded with
+``--appointments`` rows spread over three years of history and one ahead, so
+work that grows with the table at startup shows up. Prints a JSON report with
+the median of the warm and seeded runs next to the cold one.
+
+    python benchmarks/startup.py --runs 5 --appointments 500000
+
+No other service needs to be running: the gateway's downstream calls are
+answered by a stub, so its first request times its own client setup.
+"""
+import argparse
+import json
+import math
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from appointment_service.availability import TIME_SLOTS
+
+# service folder -> path of a cheap read that touches its storage and caches
+SERVICES = {
+    "patient_service": "/patients/1",
+    "appointment_service": "/appointments/history/1",
+    "billing_service": "/bills/1",
+    "gateway_service": "/dashboard/1",
+}
+
+# Runs inside the new process, with the service folder as the working directory
+CHILD = r"""
+import asyncio, json, sys, time
+sys.path.insert(0, ".")
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def first_request(path):
+    messages = []
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+    async def send(message):
+        messages.append(message)
+    scope = {"type": "http", "http_version": "1.1", "method": "GET", "scheme": "http", "path": path,
+             "raw_path": path.encode(), "root_path": "", "query_string": b"", "headers": [],
+             "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80)}
+    await main.app(scope, receive, send)
+    return messages[0]["status"]
+
+async def run(path):
+    async with main.app.router.lifespan_context(main.app):
+        started = time.perf_counter()
+        status = await first_request(path)
+        answered = time.perf_counter()
+    return started, answered, status
+
+started, answered, status = asyncio.run(run(sys.argv[1]))
+print(json.dumps({"import": imported - start, "lifespan": started - imported,
+                  "first_request": answered - started, "status": status}))
+"""
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers every GET with an empty JSON list, standing in for downstream services"""
+    # Headers and body go out in separate writes; don't let Nagle hold the body back
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"[]")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def seed_appointments(path, count, past_days=3 * 365, future_days=365):
+    """Fill every slot of as many doctors as it takes to reach ``count`` rows"""
+    days = past_days + future_days
+    doctors = math.ceil(count / (days * len(TIME_SLOTS)))
+    first_day = date.today() - timedelta(days=past_days)
+    rows = ((i % 20000 + 1, f"Dr. {doctor:04d}", (first_day + timedelta(days=d)).isoformat(), slot)
+            for i, (doctor, d, slot) in enumerate(
+                (doctor, d, slot) for doctor in range(doctors) for d in range(days) for slot in TIME_SLOTS))
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany("INSERT INTO appointments (patient_id, doctor, date, time_slot) VALUES (?, ?, ?, ?)",
+                         (row for _, row in zip(range(count), rows)))
+    conn.close()
+
+
+def start_once(service, path, env):
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", CHILD, path], cwd=os.path.join(ROOT, service),
+                         env=env, capture_output=True, text=True, check=True).stdout
+    timings = json.loads(out.strip().splitlines()[-1])
+    # Interpreter start to first response, as the process manager sees it
+    timings["process"] = time.perf_counter() - start
+    return timings
+
+
+def summarize(runs):
+    ms = lambda seconds: round(seconds * 1000, 1)
+    return {key: ms(statistics.median(r[key] for r in runs))
+            for key in ("import", "lifespan", "first_request", "process")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="warm starts per service")
+    parser.add_argument("--services", default=",".join(SERVICES))
+    parser.add_argument("--appointments", type=int, default=500000,
+                        help="rows for the seeded appointment service runs (0 to skip)")
+    args = parser.parse_args()
+
+    stub = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    stub_url = f"http://127.0.0.1:{stub.server_port}"
+
+    report = {"runs": args.runs, "services": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ,
+                   PATIENT_DB_PATH=os.path.join(tmp, "patients.db"),
+                   APPOINTMENT_DB_PATH=os.path.join(tmp, "appointments.db"),
+                   BILLING_DB_PATH=os.path.join(tmp, "billing.db"),
+                   APPOINTMENT_SERVICE_URL=stub_url,
+                   BILLING_SERVICE_URL=stub_url,
+                   PATIENT_SERVICE_URL=f"{stub_url}/patients")
+        for service in args.services.split(","):
+            path = SERVICES[service]
+            cold = start_once(service, path, env)
+            warm = [start_once(service, path, env) for _ in range(args.runs)]
+            report["services"][service] = {"status": cold["status"], "cold_ms": summarize([cold]),
+                                           "warm_ms": summarize(warm)}
+
+        if args.appointments and "appointment_service" in report["services"]:
+            # The warm runs left a migrated database to seed
+            seed_appointments(env["APPOINTMENT_DB_PATH"], args.appointments)
+            path = SERVICES["appointment_service"]
+            seeded = [start_once("appointment_service", path, env) for _ in range(args.runs)]
+            report["services"]["appointment_service"].update(
+                seeded_appointments=args.appointments, seeded_ms=summarize(seeded))
+    stub.shutdown()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
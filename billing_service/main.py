@@ -1,98 +1,250 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-import sqlite3
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Optional
 import os
-from datetime import datetime
+import sys
+from datetime import date, datetime, timedelta
 
-app = FastAPI()
+# Make the top-level shared/ package importable when running from this folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.cache import ReadThroughCache
+from shared.export import MEDIA_TYPES, stream_batches
+from shared.idempotency import IdempotencyMiddleware
+from shared.metrics import instrument
+from shared.pagination import DEFAULT_PAGE_SIZE, MAX_BULK_IDS, MAX_BULK_WRITES, MAX_PAGE_SIZE, set_next_cursor
+from billing_service.repository import EXPORT_COLUMNS, create_repository
 
-# Get the directory where this file is located
-DB_PATH = os.path.join(os.path.dirname(__file__), 'billing.db')
+# Get the directory where this file is located (the env var overrides it, e.g. for benchmarks)
+DB_PATH = os.environ.get("BILLING_DB_PATH", os.path.join(os.path.dirname(__file__), 'billing.db'))
+# Set to a postgresql:// URL to store bills in PostgreSQL instead of DB_PATH
+DATABASE_URL = os.environ.get("BILLING_DATABASE_URL", "")
+repo = create_repository(DATABASE_URL, DB_PATH)
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS bills 
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT, patient_id INTEGER, amount REAL, status TEXT, date_generated TEXT)''')
-    conn.commit()
-    conn.close()
+# Bill list pages per patient. Every write drops the affected patient's pages;
+# the TTL only bounds staleness from writes made by another worker process.
+BILL_CACHE_SIZE = int(os.environ.get("BILL_CACHE_SIZE", "10000"))
+BILL_CACHE_TTL = float(os.environ.get("BILL_CACHE_TTL", "60"))
+bill_cache = ReadThroughCache(maxsize=BILL_CACHE_SIZE, ttl=BILL_CACHE_TTL)
 
-init_db()
+@asynccontextmanager
+async def lifespan(app):
+    # Creates the tables on first run and applies any newer migrations
+    await repo.open()
+    yield
+    # Close pooled connections cleanly on shutdown
+    await repo.close()
+
+app = FastAPI(lifespan=lifespan)
+# Writes repeated with the same Idempotency-Key header replay the first response
+app.add_middleware(IdempotencyMiddleware)
+# Latency/in-flight metrics on every route, served on /metrics
+instrument(app)
+
+# Flat fee charged per appointment
+APPOINTMENT_FEE = 150.0
+
+# Longest date range a single daily-totals query may cover
+MAX_SUMMARY_DAYS = 366
 
 class PayBillRequest(BaseModel):
     bill_id: int
 
+class BulkPayRequest(BaseModel):
+    bill_ids: list[int] = Field(max_length=MAX_BULK_WRITES)
+
+class BillRequest(BaseModel):
+    patient_id: int
+    idempotency_key: str
+
+class GenerateBillsRequest(BaseModel):
+    bills: list[BillRequest]
+
+class BulkBillsRequest(BaseModel):
+    patient_ids: list[int] = Field(max_length=MAX_BULK_IDS)
+    status: Optional[str] = None
+
 @app.post("/bills/generate")
-def generate_bill(patient_id: int):
+async def generate_bill(patient_id: int):
     # This might be triggered by the appointment service in a real app
     # Here we simulate generating a bill
     try:
         today = datetime.now().strftime("%Y-%m-%d")
-        conn = sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False)
-        c = conn.cursor()
-        c.execute("INSERT INTO bills (patient_id, amount, status, date_generated) VALUES (?, ?, ?, ?)", 
-                  (patient_id, 150.0, "PENDING", today))
-        conn.commit()
-        conn.close()
+        await repo.create_bill(patient_id, APPOINTMENT_FEE, today)
+        bill_cache.invalidate(patient_id)
         return {"message": "Bill generated"}
     except Exception as e:
         print(f"ERROR in generate_bill: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+@app.post("/bills/generate/batch")
+async def generate_bills(req: GenerateBillsRequest):
+    """Generate many bills in one transaction. Keys that were already billed are skipped,
+    so the appointment service can safely resend a batch."""
+    try:
+        today = datetime.now().strftime("%Y-%m-%d")
+        created = await repo.create_bills([(b.patient_id, b.idempotency_key) for b in req.bills],
+                                          APPOINTMENT_FEE, today)
+        if created:
+            bill_cache.invalidate_many(b.patient_id for b in req.bills)
+        return {"message": "Bills generated", "created": created, "duplicates": len(req.bills) - created}
+    except Exception as e:
+        print(f"ERROR in generate_bills: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+# Declared before /bills/{patient_id} so "export" isn't taken for a patient id
+@app.get("/bills/export")
+def export_bills(fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+                 start: Optional[date] = None, end: Optional[date] = None):
+    """Stream every bill as NDJSON or CSV, optionally limited to start <= date_generated <= end"""
+    return StreamingResponse(stream_batches(repo.export(start and start.isoformat(), end and end.isoformat()),
+                                            EXPORT_COLUMNS, fmt),
+                             media_type=MEDIA_TYPES[fmt],
+                             headers={"Content-Disposition": f"attachment; filename=bills.{fmt}"})
+
+def format_bill(r):
+    return {"id": r[0], "amount": r[1], "status": r[2], "date": r[3]}
+
+def parse_cursor(after):
+    try:
+        return int(after)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def list_bills(patient_id, status, response, limit, after):
+    """One page of a patient's bills in id order, optionally filtered by status"""
+    after = parse_cursor(after) if after else None
+    rows = await bill_cache.aget_or_load(patient_id, (status, limit, after),
+                                         lambda: repo.list_bills(patient_id, status, limit, after))
+    set_next_cursor(response, rows, limit, lambda r: str(r[0]))
+    return [format_bill(r) for r in rows]
+
 @app.get("/bills/{patient_id}")
-def get_bills(patient_id: int):
+async def get_bills(patient_id: int, response: Response,
+              limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None):
     try:
-        conn = sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False)
-        c = conn.cursor()
-        c.execute("SELECT id, amount, status, date_generated FROM bills WHERE patient_id=?", (patient_id,))
-        rows = c.fetchall()
-        conn.close()
-        return [{"id": r[0], "amount": r[1], "status": r[2], "date": r[3]} for r in rows]
+        return await list_bills(patient_id, None, response, limit, after)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"ERROR in get_bills: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+@app.post("/bills/bulk")
+async def get_bills_bulk(req: BulkBillsRequest):
+    """Bills for many patients at once, grouped by patient id"""
+    patient_ids = list(dict.fromkeys(req.patient_ids))
+    try:
+        bills = {patient_id: [] for patient_id in patient_ids}
+        for r in await repo.bills_for_patients(patient_ids, req.status):
+            bills[r[4]].append(format_bill(r))
+        return bills
+    except Exception as e:
+        print(f"ERROR in get_bills_bulk: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
 @app.get("/bills/pending/{patient_id}")
-def get_pending_bills(patient_id: int):
+async def get_pending_bills(patient_id: int, response: Response,
+                      limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None):
     """Get only pending (unpaid) bills"""
     try:
-        conn = sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False)
-        c = conn.cursor()
-        c.execute("SELECT id, amount, status, date_generated FROM bills WHERE patient_id=? AND status='PENDING'", (patient_id,))
-        rows = c.fetchall()
-        conn.close()
-        return [{"id": r[0], "amount": r[1], "status": r[2], "date": r[3]} for r in rows]
+        return await list_bills(patient_id, "PENDING", response, limit, after)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"ERROR in get_pending_bills: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 @app.get("/bills/paid/{patient_id}")
-def get_paid_bills(patient_id: int):
+async def get_paid_bills(patient_id: int, response: Response,
+                   limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None):
     """Get only paid bills"""
     try:
-        conn = sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False)
-        c = conn.cursor()
-        c.execute("SELECT id, amount, status, date_generated FROM bills WHERE patient_id=? AND status='PAID'", (patient_id,))
-        rows = c.fetchall()
-        conn.close()
-        return [{"id": r[0], "amount": r[1], "status": r[2], "date": r[3]} for r in rows]
+        return await list_bills(patient_id, "PAID", response, limit, after)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"ERROR in get_paid_bills: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 @app.post("/bills/pay")
-def pay_bill(req: PayBillRequest):
+async def pay_bill(req: PayBillRequest):
     """Mark a bill as paid"""
     try:
-        conn = sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False)
-        c = conn.cursor()
-        c.execute("UPDATE bills SET status='PAID' WHERE id=?", (req.bill_id,))
-        conn.commit()
-        conn.close()
+        today = datetime.now().strftime("%Y-%m-%d")
+        patient_id = await repo.pay_bill(req.bill_id, today)
+        if patient_id is not None:
+            bill_cache.invalidate(patient_id)
         return {"message": "Bill paid successfully"}
     except Exception as e:
         print(f"ERROR in pay_bill: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
     except Exception as e:
         print(f"ERROR in get_bills: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+@app.post("/bills/pay/bulk")
+async def pay_bills_bulk(req: BulkPayRequest):
+    """Mark many bills as paid in one transaction; each id gets its own result"""
+    bill_ids = list(dict.fromkeys(req.bill_ids))
+    try:
+        today = datetime.now().strftime("%Y-%m-%d")
+        found, to_pay = await repo.pay_bills(bill_ids, today)
+        bill_cache.invalidate_many(found[bill_id][1] for bill_id in to_pay)
+    except Exception as e:
+        print(f"ERROR in pay_bills_bulk: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    results = []
+    paid_now = set(to_pay)
+    for bill_id in req.bill_ids:
+        if bill_id not in found:
+            results.append({"bill_id": bill_id, "status": "not_found"})
+        elif bill_id in paid_now:
+            results.append({"bill_id": bill_id, "status": "paid"})
+            # A repeated id reports as already paid the second time
+            paid_now.discard(bill_id)
+        else:
+            results.append({"bill_id": bill_id, "status": "already_paid"})
+    return {"paid": len(to_pay), "results": results}
+
+def format_totals(billed_count, billed_amount, paid_count, paid_amount):
+    return {"billed_count": billed_count, "billed_amount": billed_amount,
+            "paid_count": paid_count, "paid_amount": paid_amount}
+
+# Declared before /bills/summary/{patient_id} so "daily" isn't taken for a patient id
+@app.get("/bills/summary/daily")
+async def get_daily_totals(start: Optional[date] = None, end: Optional[date] = None):
+    """Billed and paid totals per day from start to end (inclusive, default: the last 30 days).
+    Days without any billing activity are left out."""
+    end = end or date.today()
+    start = start or end - timedelta(days=29)
+    if end < start or (end - start).days >= MAX_SUMMARY_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range must be 1 to {MAX_SUMMARY_DAYS} days")
+    try:
+        rows = await repo.daily_totals(start.isoformat(), end.isoformat())
+    except Exception as e:
+        print(f"ERROR in get_daily_totals: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    days = [{"date": r[0], **format_totals(*r[1:])} for r in rows]
+    totals = format_totals(*(sum(r[i] for r in rows) for i in range(1, 5)))
+    return {"start": start.isoformat(), "end": end.isoformat(), "days": days, "totals": totals}
+
+@app.get("/bills/summary/{patient_id}")
+async def get_patient_summary(patient_id: int):
+    """A patient's outstanding and paid totals, read from the running balance"""
+    try:
+        row = await repo.patient_summary(patient_id)
+    except Exception as e:
+        print(f"ERROR in get_patient_summary: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    pending_count, pending_amount, paid_count, paid_amount = row or (0, 0.0, 0, 0.0)
+    return {"patient_id": patient_id,
+            "pending_count": pending_count, "pending_amount": pending_amount,
+            "paid_count": paid_count, "paid_amount": paid_amount}
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    """Hit/miss counters and approximate memory use of the in-process caches"""
+    return {"bills": bill_cache.stats()}
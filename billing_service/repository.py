@@ -0,0 +1,322 @@
+"""Storage for bills, on SQLite or PostgreSQL (see ``shared.repository``).
+
+Besides the bills themselves, every write keeps two summary tables current in
+the same transaction: ``patient_balances`` (pending and paid count/amount per
+patient) and ``daily_totals`` (billed and paid count/amount per day). Reading a
+balance or a day's revenue is then a primary-key lookup, however many bills
+there are. ``rebuild_summaries`` recomputes both from the bills in bulk.
+"""
+from shared.export import BATCH_SIZE
+from shared.pagination import chunks, placeholders
+from shared.repository import PostgresRepository, SqliteRepository, blocking, is_postgres_url
+from billing_service.schema import MIGRATIONS, POSTGRES_MIGRATIONS
+
+EXPORT_COLUMNS = ["id", "patient_id", "amount", "status", "date_generated"]
+
+# Recomputes the summary tables from scratch; the same SQL runs on both backends
+REBUILD_SUMMARIES = [
+    "DELETE FROM patient_balances",
+    "DELETE FROM daily_totals",
+    """INSERT INTO patient_balances (patient_id, pending_count, pending_amount, paid_count, paid_amount)
+       SELECT patient_id,
+              SUM(CASE WHEN status = 'PENDING' THEN 1 ELSE 0 END), SUM(CASE WHEN status = 'PENDING' THEN amount ELSE 0.0 END),
+              SUM(CASE WHEN status = 'PAID' THEN 1 ELSE 0 END), SUM(CASE WHEN status = 'PAID' THEN amount ELSE 0.0 END)
+       FROM bills WHERE patient_id IS NOT NULL GROUP BY patient_id""",
+    # Billed on the day generated, paid on the day paid (older rows have no
+    # payment date and count on the day they were billed)
+    """INSERT INTO daily_totals (day, billed_count, billed_amount, paid_count, paid_amount)
+       SELECT day, SUM(billed_count), SUM(billed_amount), SUM(paid_count), SUM(paid_amount) FROM (
+           SELECT date_generated AS day, COUNT(*) AS billed_count, SUM(amount) AS billed_amount,
+                  0 AS paid_count, 0.0 AS paid_amount
+           FROM bills WHERE date_generated IS NOT NULL GROUP BY date_generated
+           UNION ALL
+           SELECT COALESCE(date_paid, date_generated), 0, 0.0, COUNT(*), SUM(amount)
+           FROM bills WHERE status = 'PAID' AND COALESCE(date_paid, date_generated) IS NOT NULL
+           GROUP BY COALESCE(date_paid, date_generated)
+       ) AS totals GROUP BY day""",
+]
+
+
+def _export_filters(start, end, placeholder):
+    """WHERE clause and params for start <= date_generated <= end"""
+    clauses = []
+    params = []
+    for op, value in ((">=", start), ("<=", end)):
+        if value:
+            params.append(value)
+            clauses.append(f"date_generated {op} {placeholder(len(params))}")
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+def summary_deltas(today, billed=(), paid=()):
+    """What to add to the summary tables for bills created and bills paid today.
+
+    ``billed`` and ``paid`` are (patient_id, amount) pairs. Returns rows of
+    (patient_id, pending_count, pending_amount, paid_count, paid_amount) and
+    (day, billed_count, billed_amount, paid_count, paid_amount) deltas.
+    """
+    balances = {}
+    day = [0, 0.0, 0, 0.0]
+    for patient_id, amount in billed:
+        balance = balances.setdefault(patient_id, [0, 0.0, 0, 0.0])
+        balance[0] += 1
+        balance[1] += amount
+        day[0] += 1
+        day[1] += amount
+    for patient_id, amount in paid:
+        balance = balances.setdefault(patient_id, [0, 0.0, 0, 0.0])
+        balance[0] -= 1
+        balance[1] -= amount
+        balance[2] += 1
+        balance[3] += amount
+        day[2] += 1
+        day[3] += amount
+    days = [(today, *day)] if day[0] or day[2] else []
+    return [(patient_id, *balance) for patient_id, balance in balances.items()], days
+
+
+class SqliteBillRepository(SqliteRepository):
+
+    def __init__(self, path, **db_options):
+        super().__init__(path, MIGRATIONS, **db_options)
+
+    def _update_summaries(self, conn, today, billed=(), paid=()):
+        balances, days = summary_deltas(today, billed, paid)
+        conn.executemany("""INSERT INTO patient_balances (patient_id, pending_count, pending_amount, paid_count, paid_amount)
+                            VALUES (?, ?, ?, ?, ?) ON CONFLICT (patient_id) DO UPDATE SET
+                            pending_count = pending_count + excluded.pending_count,
+                            pending_amount = pending_amount + excluded.pending_amount,
+                            paid_count = paid_count + excluded.paid_count,
+                            paid_amount = paid_amount + excluded.paid_amount""", balances)
+        conn.executemany("""INSERT INTO daily_totals (day, billed_count, billed_amount, paid_count, paid_amount)
+                            VALUES (?, ?, ?, ?, ?) ON CONFLICT (day) DO UPDATE SET
+                            billed_count = billed_count + excluded.billed_count,
+                            billed_amount = billed_amount + excluded.billed_amount,
+                            paid_count = paid_count + excluded.paid_count,
+                            paid_amount = paid_amount + excluded.paid_amount""", days)
+
+    @blocking
+    def create_bill(self, patient_id, amount, today):
+        with self.db.transaction() as conn:
+            conn.execute("INSERT INTO bills (patient_id, amount, status, date_generated) VALUES (?, ?, ?, ?)",
+                         (patient_id, amount, "PENDING", today))
+            self._update_summaries(conn, today, billed=[(patient_id, amount)])
+
+    @blocking
+    def create_bills(self, bills, amount, today):
+        """Insert (patient_id, idempotency_key) bills in one transaction, skipping keys
+        that were already billed. Returns how many were created."""
+        with self.db.transaction() as conn:
+            # BEGIN IMMEDIATE holds the write lock, so every id above the
+            # previous maximum is one of ours
+            last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM bills").fetchone()[0]
+            conn.executemany("""INSERT INTO bills (patient_id, amount, status, date_generated, idempotency_key)
+                                VALUES (?, ?, ?, ?, ?) ON CONFLICT (idempotency_key) DO NOTHING""",
+                             [(patient_id, amount, "PENDING", today, key) for patient_id, key in bills])
+            created = conn.execute("SELECT patient_id, amount FROM bills WHERE id > ?", (last_id,)).fetchall()
+            self._update_summaries(conn, today, billed=created)
+            return len(created)
+
+    @blocking
+    def list_bills(self, patient_id, status, limit, after=None):
+        """(id, amount, status, date_generated) of one page of a patient's bills, in id order"""
+        sql = "SELECT id, amount, status, date_generated FROM bills WHERE patient_id=?"
+        params = [patient_id]
+        if status:
+            sql += " AND status=?"
+            params.append(status)
+        if after:
+            sql += " AND id > ?"
+            params.append(after)
+        with self.db.connection() as conn:
+            return conn.execute(sql + " ORDER BY id LIMIT ?", (*params, limit)).fetchall()
+
+    @blocking
+    def bills_for_patients(self, patient_ids, status=None):
+        """(id, amount, status, date_generated, patient_id) of many patients' bills, in id order per chunk"""
+        status_filter = "AND status=?" if status else ""
+        rows = []
+        with self.db.connection() as conn:
+            for chunk in chunks(patient_ids):
+                params = [*chunk, status] if status else chunk
+                c = conn.execute(f"""SELECT id, amount, status, date_generated, patient_id FROM bills
+                                     WHERE patient_id IN ({placeholders(len(chunk))}) {status_filter} ORDER BY id""", params)
+                rows.extend(c)
+        return rows
+
+    @blocking
+    def pay_bill(self, bill_id, today):
+        """Mark a bill paid. Returns its patient id, or None if there is no such bill."""
+        with self.db.transaction() as conn:
+            bill = conn.execute("SELECT patient_id, amount, status FROM bills WHERE id=?", (bill_id,)).fetchone()
+            if bill and bill[2] == "PENDING":
+                conn.execute("UPDATE bills SET status='PAID', date_paid=? WHERE id=?", (today, bill_id))
+                self._update_summaries(conn, today, paid=[(bill[0], bill[1])])
+        return bill[0] if bill else None
+
+    @blocking
+    def pay_bills(self, bill_ids, today):
+        """Mark the pending ones among many bills paid, in one transaction.
+
+        Returns ({bill_id: (status before, patient_id)} for the bills that exist,
+        [ids that were paid now]).
+        """
+        with self.db.transaction() as conn:
+            # Look up every bill's current status with one query per chunk
+            found = {}
+            amounts = {}
+            for chunk in chunks(bill_ids):
+                c = conn.execute(f"SELECT id, status, patient_id, amount FROM bills WHERE id IN ({placeholders(len(chunk))})", chunk)
+                for bill_id, status, patient_id, amount in c:
+                    found[bill_id] = (status, patient_id)
+                    amounts[bill_id] = amount
+            to_pay = [bill_id for bill_id in dict.fromkeys(bill_ids) if found.get(bill_id, (None,))[0] == "PENDING"]
+            conn.executemany("UPDATE bills SET status='PAID', date_paid=? WHERE id=?",
+                             [(today, bill_id) for bill_id in to_pay])
+            self._update_summaries(conn, today, paid=[(found[bill_id][1], amounts[bill_id]) for bill_id in to_pay])
+        return found, to_pay
+
+    @blocking
+    def patient_summary(self, patient_id):
+        """(pending_count, pending_amount, paid_count, paid_amount), or None if the patient has no bills"""
+        with self.db.connection() as conn:
+            return conn.execute("""SELECT pending_count, pending_amount, paid_count, paid_amount
+                                   FROM patient_balances WHERE patient_id=?""", (patient_id,)).fetchone()
+
+    @blocking
+    def daily_totals(self, start, end):
+        """(day, billed_count, billed_amount, paid_count, paid_amount) for each day with activity, start <= day <= end"""
+        with self.db.connection() as conn:
+            return conn.execute("""SELECT day, billed_count, billed_amount, paid_count, paid_amount FROM daily_totals
+                                   WHERE day >= ? AND day <= ? ORDER BY day""", (start, end)).fetchall()
+
+    @blocking
+    def rebuild_summaries(self):
+        """Recompute the summary tables from the bills. Returns (patients, days) written."""
+        with self.db.transaction() as conn:
+            for sql in REBUILD_SUMMARIES:
+                conn.execute(sql)
+            return (conn.execute("SELECT COUNT(*) FROM patient_balances").fetchone()[0],
+                    conn.execute("SELECT COUNT(*) FROM daily_totals").fetchone()[0])
+
+    def export(self, start=None, end=None, batch_size=BATCH_SIZE):
+        """Batches of EXPORT_COLUMNS rows in id order, optionally limited to start <= date_generated <= end"""
+        where, params = _export_filters(start, end, lambda n: "?")
+        return self.stream(f"SELECT {', '.join(EXPORT_COLUMNS)} FROM bills{where} ORDER BY id", params, batch_size)
+
+
+class PostgresBillRepository(PostgresRepository):
+
+    def __init__(self, url, **pool_options):
+        super().__init__(url, "bills", POSTGRES_MIGRATIONS, **pool_options)
+
+    async def _update_summaries(self, conn, today, billed=(), paid=()):
+        balances, days = summary_deltas(today, billed, paid)
+        # Sorted so concurrent transactions lock the balance rows in the same order
+        await conn.executemany("""INSERT INTO patient_balances AS b (patient_id, pending_count, pending_amount, paid_count, paid_amount)
+                                  VALUES ($1, $2, $3, $4, $5) ON CONFLICT (patient_id) DO UPDATE SET
+                                  pending_count = b.pending_count + excluded.pending_count,
+                                  pending_amount = b.pending_amount + excluded.pending_amount,
+                                  paid_count = b.paid_count + excluded.paid_count,
+                                  paid_amount = b.paid_amount + excluded.paid_amount""", sorted(balances))
+        await conn.executemany("""INSERT INTO daily_totals AS d (day, billed_count, billed_amount, paid_count, paid_amount)
+                                  VALUES ($1, $2, $3, $4, $5) ON CONFLICT (day) DO UPDATE SET
+                                  billed_count = d.billed_count + excluded.billed_count,
+                                  billed_amount = d.billed_amount + excluded.billed_amount,
+                                  paid_count = d.paid_count + excluded.paid_count,
+                                  paid_amount = d.paid_amount + excluded.paid_amount""", days)
+
+    async def create_bill(self, patient_id, amount, today):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("INSERT INTO bills (patient_id, amount, status, date_generated) VALUES ($1, $2, $3, $4)",
+                                   patient_id, amount, "PENDING", today)
+                await self._update_summaries(conn, today, billed=[(patient_id, amount)])
+
+    async def create_bills(self, bills, amount, today):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # One statement for the whole batch; RETURNING lists the rows inserted
+                created = await conn.fetch(
+                    """INSERT INTO bills (patient_id, amount, status, date_generated, idempotency_key)
+                       SELECT patient_id, $3, 'PENDING', $4, key FROM unnest($1::bigint[], $2::text[]) AS b (patient_id, key)
+                       ON CONFLICT (idempotency_key) DO NOTHING RETURNING patient_id, amount""",
+                    [patient_id for patient_id, _ in bills], [key for _, key in bills], amount, today)
+                await self._update_summaries(conn, today, billed=[tuple(r) for r in created])
+        return len(created)
+
+    async def list_bills(self, patient_id, status, limit, after=None):
+        sql = "SELECT id, amount, status, date_generated FROM bills WHERE patient_id=$1"
+        params = [patient_id]
+        if status:
+            params.append(status)
+            sql += f" AND status=${len(params)}"
+        if after:
+            params.append(after)
+            sql += f" AND id > ${len(params)}"
+        params.append(limit)
+        rows = await self.pool.fetch(sql + f" ORDER BY id LIMIT ${len(params)}", *params)
+        return [tuple(r) for r in rows]
+
+    async def bills_for_patients(self, patient_ids, status=None):
+        sql = "SELECT id, amount, status, date_generated, patient_id FROM bills WHERE patient_id = ANY($1::bigint[])"
+        params = [patient_ids]
+        if status:
+            sql += " AND status=$2"
+            params.append(status)
+        rows = await self.pool.fetch(sql + " ORDER BY id", *params)
+        return [tuple(r) for r in rows]
+
+    async def pay_bill(self, bill_id, today):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                bill = await conn.fetchrow("SELECT patient_id, amount, status FROM bills WHERE id=$1 FOR UPDATE", bill_id)
+                if bill and bill[2] == "PENDING":
+                    await conn.execute("UPDATE bills SET status='PAID', date_paid=$2 WHERE id=$1", bill_id, today)
+                    await self._update_summaries(conn, today, paid=[(bill[0], bill[1])])
+        return bill[0] if bill else None
+
+    async def pay_bills(self, bill_ids, today):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # Row locks stand in for SQLite's write lock between the read and the update
+                rows = await conn.fetch("""SELECT id, status, patient_id, amount FROM bills WHERE id = ANY($1::bigint[])
+                                           ORDER BY id FOR UPDATE""", bill_ids)
+                found = {r[0]: (r[1], r[2]) for r in rows}
+                amounts = {r[0]: r[3] for r in rows}
+                to_pay = [bill_id for bill_id in dict.fromkeys(bill_ids) if found.get(bill_id, (None,))[0] == "PENDING"]
+                await conn.execute("UPDATE bills SET status='PAID', date_paid=$2 WHERE id = ANY($1::bigint[])",
+                                   to_pay, today)
+                await self._update_summaries(conn, today, paid=[(found[bill_id][1], amounts[bill_id]) for bill_id in to_pay])
+        return found, to_pay
+
+    async def patient_summary(self, patient_id):
+        row = await self.pool.fetchrow("""SELECT pending_count, pending_amount, paid_count, paid_amount
+                                          FROM patient_balances WHERE patient_id=$1""", patient_id)
+        return tuple(row) if row else None
+
+    async def daily_totals(self, start, end):
+        rows = await self.pool.fetch("""SELECT day, billed_count, billed_amount, paid_count, paid_amount FROM daily_totals
+                                        WHERE day >= $1 AND day <= $2 ORDER BY day""", start, end)
+        return [tuple(r) for r in rows]
+
+    async def rebuild_summaries(self):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # Keep bill writes out until the new totals are in place
+                await conn.execute("LOCK TABLE bills IN SHARE MODE")
+                for sql in REBUILD_SUMMARIES:
+                    await conn.execute(sql)
+                return (await conn.fetchval("SELECT COUNT(*) FROM patient_balances"),
+                        await conn.fetchval("SELECT COUNT(*) FROM daily_totals"))
+
+    def export(self, start=None, end=None, batch_size=BATCH_SIZE):
+        where, params = _export_filters(start, end, lambda n: f"${n}")
+        return self.stream(f"SELECT {', '.join(EXPORT_COLUMNS)} FROM bills{where} ORDER BY id", params, batch_size)
+
+
+def create_repository(url, path):
+    """PostgreSQL if ``url`` is a postgresql:// URL, otherwise the SQLite file at ``path``"""
+    if is_postgres_url(url):
+        return PostgresBillRepository(url)
+    return SqliteBillRepository(path)
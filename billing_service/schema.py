@@ -0,0 +1,66 @@
+"""Schema migrations for billing.db (and the PostgreSQL backend). Append new versions; never edit old ones."""
+
+MIGRATIONS = [
+    # 1: original table
+    '''CREATE TABLE IF NOT EXISTS bills
+       (id INTEGER PRIMARY KEY AUTOINCREMENT, patient_id INTEGER, amount REAL, status TEXT, date_generated TEXT);''',
+
+    # 2: bills are always listed per patient, optionally filtered by status
+    '''CREATE INDEX IF NOT EXISTS idx_bills_patient_status ON bills (patient_id, status);''',
+
+    # 3: bills requested through the batch endpoint carry a key so retries don't bill twice
+    '''ALTER TABLE bills ADD COLUMN idempotency_key TEXT;
+       CREATE UNIQUE INDEX IF NOT EXISTS idx_bills_idempotency_key ON bills (idempotency_key);''',
+
+    # 4: listing all of a patient's bills pages through them in id order
+    '''CREATE INDEX IF NOT EXISTS idx_bills_patient ON bills (patient_id);''',
+
+    # 5: running totals per patient and per day, kept up to date by every bill
+    #    write. Backfilled from the existing bills, whose payment date wasn't
+    #    recorded, so their payments count on the day they were billed.
+    '''ALTER TABLE bills ADD COLUMN date_paid TEXT;
+       CREATE TABLE IF NOT EXISTS patient_balances
+       (patient_id INTEGER PRIMARY KEY, pending_count INTEGER NOT NULL DEFAULT 0, pending_amount REAL NOT NULL DEFAULT 0,
+        paid_count INTEGER NOT NULL DEFAULT 0, paid_amount REAL NOT NULL DEFAULT 0);
+       CREATE TABLE IF NOT EXISTS daily_totals
+       (day TEXT PRIMARY KEY, billed_count INTEGER NOT NULL DEFAULT 0, billed_amount REAL NOT NULL DEFAULT 0,
+        paid_count INTEGER NOT NULL DEFAULT 0, paid_amount REAL NOT NULL DEFAULT 0);
+       INSERT INTO patient_balances (patient_id, pending_count, pending_amount, paid_count, paid_amount)
+       SELECT patient_id, SUM(status = 'PENDING'), TOTAL(CASE WHEN status = 'PENDING' THEN amount END),
+              SUM(status = 'PAID'), TOTAL(CASE WHEN status = 'PAID' THEN amount END)
+       FROM bills WHERE patient_id IS NOT NULL GROUP BY patient_id;
+       INSERT INTO daily_totals (day, billed_count, billed_amount, paid_count, paid_amount)
+       SELECT date_generated, COUNT(*), TOTAL(amount),
+              SUM(status = 'PAID'), TOTAL(CASE WHEN status = 'PAID' THEN amount END)
+       FROM bills WHERE date_generated IS NOT NULL GROUP BY date_generated;''',
+]
+
+# PostgreSQL starts from the current shape of the schema above; later changes
+# get appended to both lists.
+POSTGRES_MIGRATIONS = [
+    # 1: bills, listed per patient and deduplicated by idempotency key
+    '''CREATE TABLE IF NOT EXISTS bills
+       (id BIGSERIAL PRIMARY KEY, patient_id BIGINT, amount DOUBLE PRECISION, status TEXT,
+        date_generated TEXT, idempotency_key TEXT);
+       CREATE INDEX IF NOT EXISTS idx_bills_patient_status ON bills (patient_id, status);
+       CREATE UNIQUE INDEX IF NOT EXISTS idx_bills_idempotency_key ON bills (idempotency_key);
+       CREATE INDEX IF NOT EXISTS idx_bills_patient ON bills (patient_id);''',
+
+    # 2: running totals per patient and per day (same as version 5 above)
+    '''ALTER TABLE bills ADD COLUMN IF NOT EXISTS date_paid TEXT;
+       CREATE TABLE IF NOT EXISTS patient_balances
+       (patient_id BIGINT PRIMARY KEY, pending_count BIGINT NOT NULL DEFAULT 0,
+        pending_amount DOUBLE PRECISION NOT NULL DEFAULT 0, paid_count BIGINT NOT NULL DEFAULT 0,
+        paid_amount DOUBLE PRECISION NOT NULL DEFAULT 0);
+       CREATE TABLE IF NOT EXISTS daily_totals
+       (day TEXT PRIMARY KEY, billed_count BIGINT NOT NULL DEFAULT 0, billed_amount DOUBLE PRECISION NOT NULL DEFAULT 0,
+        paid_count BIGINT NOT NULL DEFAULT 0, paid_amount DOUBLE PRECISION NOT NULL DEFAULT 0);
+       INSERT INTO patient_balances (patient_id, pending_count, pending_amount, paid_count, paid_amount)
+       SELECT patient_id, COUNT(*) FILTER (WHERE status = 'PENDING'), COALESCE(SUM(amount) FILTER (WHERE status = 'PENDING'), 0),
+              COUNT(*) FILTER (WHERE status = 'PAID'), COALESCE(SUM(amount) FILTER (WHERE status = 'PAID'), 0)
+       FROM bills WHERE patient_id IS NOT NULL GROUP BY patient_id;
+       INSERT INTO daily_totals (day, billed_count, billed_amount, paid_count, paid_amount)
+       SELECT date_generated, COUNT(*), COALESCE(SUM(amount), 0),
+              COUNT(*) FILTER (WHERE status = 'PAID'), COALESCE(SUM(amount) FILTER (WHERE status = 'PAID'), 0)
+       FROM bills WHERE date_generated IS NOT NULL GROUP BY date_generated;''',
+]
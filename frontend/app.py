@@ -1,12 +1,17 @@
 import streamlit as st
 import requests
 from datetime import date
+import uuid
 import pandas as pd
 
 # Configuration
 PATIENT_URL = "http://127.0.0.1:8001"
 APPT_URL = "http://127.0.0.1:8002"
 BILLING_URL = "http://127.0.0.1:8003"
+GATEWAY_URL = "http://127.0.0.1:8004"
+
+# How long dashboard data is reused across reruns (cleared on booking and payment)
+DASHBOARD_TTL = 30
 
 st.set_page_config(page_title="Hospital Patient App", layout="centered")
 
@@ -15,19 +20,60 @@ if 'user_id' not in st.session_state:
     st.session_state['user_id'] = None
 if 'user_name' not in st.session_state:
     st.session_state['user_name'] = None
-if 'show_past' not in st.session_state:
-    st.session_state['show_past'] = False
-if 'show_upcoming' not in st.session_state:
-    st.session_state['show_upcoming'] = False
-if 'show_pending' not in st.session_state:
-    st.session_state['show_pending'] = False
-if 'show_paid' not in st.session_state:
-    st.session_state['show_paid'] = False
 
 # --- Helper Functions ---
+@st.cache_resource
+def get_http():
+    """One pooled keep-alive session shared by every rerun"""
+    return requests.Session()
+
+def idempotency_headers(action):
+    """Idempotency-Key for one write, reused by reruns and retries until it gets an answer,
+    so a double click or a retry after a timeout can't book or register twice"""
+    name = f"idempotency_{action}"
+    if name not in st.session_state:
+        st.session_state[name] = str(uuid.uuid4())
+    return {"Idempotency-Key": st.session_state[name]}
+
+def settle_idempotency_key(action, res):
+    """The server answered (anything but a 5xx is final), so the next write gets a new key"""
+    if res.status_code < 500:
+        st.session_state.pop(f"idempotency_{action}", None)
+
+@st.cache_data(ttl=DASHBOARD_TTL, show_spinner=False)
+def fetch_dashboard(patient_id):
+    """Past/upcoming appointments and pending/paid bills in a single gateway call"""
+    res = get_http().get(f"{GATEWAY_URL}/dashboard/{patient_id}", timeout=10)
+    res.raise_for_status()
+    return res.json()
+
+def refresh_dashboard():
+    """Drop this patient's cached dashboard; other sessions keep theirs"""
+    fetch_dashboard.clear(st.session_state['user_id'])
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch_doctors():
+    """Doctors and bookable time slots, as configured in the appointment service"""
+    res = get_http().get(f"{APPT_URL}/doctors", timeout=5)
+    res.raise_for_status()
+    return res.json()
+
+@st.cache_data(ttl=DASHBOARD_TTL, show_spinner=False)
+def fetch_free_slots(doctor, day):
+    """Slots still free for a doctor on a day, plus the next free slot if there are none"""
+    res = get_http().get(f"{APPT_URL}/availability", params={"doctor": doctor, "start": day}, timeout=5)
+    res.raise_for_status()
+    free = res.json()["days"].get(day, [])
+    next_slot = None
+    if not free:
+        nxt = get_http().get(f"{APPT_URL}/availability/next", params={"doctor": doctor, "after": day}, timeout=5)
+        if nxt.status_code == 200:
+            next_slot = nxt.json()
+    return free, next_slot
+
 def login_user(name, password):
     try:
-        res = requests.post(f"{PATIENT_URL}/login", json={"name": name, "password": password})
+        res = get_http().post(f"{PATIENT_URL}/login", json={"name": name, "password": password})
         if res.status_code == 200:
             data = res.json()
             st.session_state['user_id'] = data['id']
@@ -40,7 +86,9 @@ def login_user(name, password):
 
 def register_user(name, age, password):
     try:
-        res = requests.post(f"{PATIENT_URL}/register", json={"name": name, "age": age, "password": password})
+        res = get_http().post(f"{PATIENT_URL}/register", json={"name": name, "age": age, "password": password},
+                              headers=idempotency_headers("register"))
+        settle_idempotency_key("register", res)
         if res.status_code == 200:
             st.success("Registration Successful! Please Log in.")
         else:
@@ -49,6 +97,7 @@ def register_user(name, age, password):
         st.error("Patient Service is unreachable.")
 
 def logout():
+    refresh_dashboard()
     st.session_state['user_id'] = None
     st.session_state['user_name'] = None
     st.rerun()
@@ -87,16 +136,36 @@ else:
     # --- BOOKING TAB ---
     with tab_book:
         st.header("New Appointment")
+        if st.session_state.get('booking_notice'):
+            st.success(st.session_state.pop('booking_notice'))
+            # The bill is queued with the booking and delivered in the background,
+            # so it usually isn't in the dashboard yet
+            st.info("💡 A bill for this appointment will appear under My Bills shortly (use Refresh Bills).")
+        try:
+            doctors = fetch_doctors()["doctors"]
+        except Exception:
+            doctors = []
+            st.error("Appointment Service is offline.")
+
+        # Doctor and date sit outside the form so the free slots update as they change
+        col1, col2 = st.columns(2)
+        doctor = col1.selectbox("Select Doctor", doctors)
+        appt_date = col2.date_input("Select Date", min_value=date.today())
+
+        free_slots, next_slot = [], None
+        if doctor:
+            try:
+                free_slots, next_slot = fetch_free_slots(doctor, str(appt_date))
+            except Exception:
+                st.error("Could not load available time slots.")
+        if doctor and not free_slots and next_slot:
+            st.warning(f"{doctor} is fully booked that day. Next free slot: {next_slot['date']} at {next_slot['time_slot']}")
+
         with st.form("booking_form"):
-            col1, col2 = st.columns(2)
-            doctor = col1.selectbox("Select Doctor", ["Dr. Gregory House", "Dr. Meredith Grey", "Dr. Shaun Murphy"])
-            appt_date = col2.date_input("Select Date", min_value=date.today())
-            
-            # Constraint: Specific Time Slots
-            time_slot = st.selectbox("Select Time", 
-                ["09:00", "10:00", "11:00", "13:00", "14:00", "15:00", "16:00"])
+            # Constraint: Specific Time Slots, only the ones still free
+            time_slot = st.selectbox("Select Time", free_slots)
             
-            submit = st.form_submit_button("Book Appointment")
+            submit = st.form_submit_button("Book Appointment", disabled=not free_slots)
             
             if submit:
                 payload = {
@@ -106,43 +175,54 @@ else:
                     "time_slot": time_slot
                 }
                 try:
-                    res = requests.post(f"{APPT_URL}/appointments/", json=payload)
+                    res = get_http().post(f"{APPT_URL}/appointments/", json=payload,
+                                          headers=idempotency_headers("booking"))
+                    settle_idempotency_key("booking", res)
                     if res.status_code == 200:
-                        st.success(f"✅ Booked with {doctor} at {time_slot}")
-                        st.info("💡 A bill has been automatically generated for this appointment.")
+                        refresh_dashboard()
+                        fetch_free_slots.clear()
+                        # Rerun so the slot list no longer offers the slot just booked
+                        st.session_state['booking_notice'] = f"✅ Booked with {doctor} at {time_slot}"
+                        st.rerun()
                     else:
                         st.error(f"❌ Failed: {res.json()['detail']}")
-                except:
+                except Exception:
                     st.error("Appointment Service is offline.")
 
+    # Everything the history and bills tabs show, in one cached request
+    dashboard = None
+    dashboard_error = None
+    try:
+        dashboard = fetch_dashboard(st.session_state['user_id'])
+    except Exception as e:
+        dashboard_error = str(e)
+    errors = dashboard['errors'] if dashboard else {}
+
+    def show_section(name, label):
+        """Return a dashboard section, or show why it couldn't be loaded"""
+        if dashboard is None:
+            st.error(f"Could not fetch {label}: {dashboard_error}")
+            return None
+        if name in errors:
+            st.error(f"Error fetching {label}: {errors[name]}")
+            return None
+        if name in dashboard.get('truncated', {}):
+            st.caption(f"Showing the first {dashboard['truncated'][name]} {label} only.")
+        return dashboard[name]
+
     # --- HISTORY TAB ---
     with tab_hist:
         st.header("My Appointments")
+        if st.button("Refresh Appointments", key="btn_appts"):
+            refresh_dashboard()
+            st.rerun()
 
         # Past Appointments
         st.subheader("📋 Past Appointments")
-        if st.button("Refresh Past Appointments", key="btn_past"):
-            with st.spinner("Loading past appointments..."):
-                try:
-                    url = f"{APPT_URL}/appointments/past/{st.session_state['user_id']}"
-                    print(f"DEBUG: Fetching PAST from {url}")
-                    res = requests.get(url, timeout=10)
-                    print(f"DEBUG: Past Status code {res.status_code}")
-                    if res.status_code == 200:
-                        data = res.json()
-                        st.session_state['past_data'] = data if data else []
-                    else:
-                        st.error(f"Error fetching past appointments: {res.status_code}")
-                        st.session_state['past_data'] = None
-                except Exception as e:
-                    print(f"DEBUG - Past Error: {str(e)}")
-                    st.error(f"Could not fetch past appointments: {type(e).__name__}: {str(e)}")
-                    st.session_state['past_data'] = None
-
-        # Display past appointments
-        if 'past_data' in st.session_state and st.session_state['past_data'] is not None:
-            if st.session_state['past_data']:
-                df = pd.DataFrame(st.session_state['past_data'])
+        past = show_section('past', "past appointments")
+        if past is not None:
+            if past:
+                df = pd.DataFrame(past)
                 st.dataframe(df, use_container_width=True)
             else:
                 st.info("No past appointments found.")
@@ -151,28 +231,10 @@ else:
 
         # Upcoming Appointments
         st.subheader("📅 Upcoming Appointments")
-        if st.button("Refresh Upcoming Appointments", key="btn_upcoming"):
-            with st.spinner("Loading upcoming appointments..."):
-                try:
-                    url = f"{APPT_URL}/appointments/upcoming/{st.session_state['user_id']}"
-                    print(f"DEBUG: Fetching UPCOMING from {url}")
-                    res = requests.get(url, timeout=10)
-                    print(f"DEBUG: Upcoming Status code {res.status_code}")
-                    if res.status_code == 200:
-                        data = res.json()
-                        st.session_state['upcoming_data'] = data if data else []
-                    else:
-                        st.error(f"Error fetching upcoming appointments: {res.status_code}")
-                        st.session_state['upcoming_data'] = None
-                except Exception as e:
-                    print(f"DEBUG - Upcoming Error: {str(e)}")
-                    st.error(f"Could not fetch upcoming appointments: {type(e).__name__}: {str(e)}")
-                    st.session_state['upcoming_data'] = None
-
-        # Display upcoming appointments
-        if 'upcoming_data' in st.session_state and st.session_state['upcoming_data'] is not None:
-            if st.session_state['upcoming_data']:
-                df = pd.DataFrame(st.session_state['upcoming_data'])
+        upcoming = show_section('upcoming', "upcoming appointments")
+        if upcoming is not None:
+            if upcoming:
+                df = pd.DataFrame(upcoming)
                 st.dataframe(df, use_container_width=True)
             else:
                 st.info("No upcoming appointments found.")
@@ -180,68 +242,49 @@ else:
     # --- BILLS TAB ---
     with tab_bill:
         st.header("My Invoices")
+        if st.button("Refresh Bills", key="btn_bills"):
+            refresh_dashboard()
+            st.rerun()
         
         col1, col2 = st.columns(2)
         
         # Pending Bills
         with col1:
             st.subheader("⏳ Pending Bills (Unpaid)")
-            if st.button("Refresh Pending Bills"):
-                st.session_state['show_pending'] = True
-            
-            if st.session_state.get('show_pending', False):
-                with st.spinner("Loading pending bills..."):
-                    try:
-                        url = f"{BILLING_URL}/bills/pending/{st.session_state['user_id']}"
-                        res = requests.get(url, timeout=5)
-                        if res.status_code == 200:
-                            data = res.json()
-                            if data:
-                                for bill in data:
-                                    col_a, col_b, col_c = st.columns([2, 1, 1])
-                                    col_a.write(f"**Amount:** ${bill['amount']}")
-                                    col_b.write(f"**Date:** {bill['date']}")
-                                    if col_c.button(f"💳 Pay", key=f"pay_{bill['id']}"):
-                                        # Pay the bill
-                                        try:
-                                            pay_url = f"{BILLING_URL}/bills/pay"
-                                            pay_res = requests.post(pay_url, json={"bill_id": bill['id']})
-                                            if pay_res.status_code == 200:
-                                                st.success("✅ Bill paid successfully!")
-                                                # Automatically refresh both views
-                                                st.session_state['show_pending'] = True
-                                                st.session_state['show_paid'] = True
-                                                st.rerun()
-                                            else:
-                                                st.error("Payment failed")
-                                        except Exception as e:
-                                            st.error(f"Payment error: {str(e)}")
-                            else:
-                                st.info("No pending bills.")
-                        else:
-                            st.error(f"Error: {res.status_code}")
-                    except Exception as e:
-                        st.error(f"Could not fetch pending bills: {str(e)}")
+            pending = show_section('pending_bills', "pending bills")
+            if pending is not None:
+                if pending:
+                    for bill in pending:
+                        col_a, col_b, col_c = st.columns([2, 1, 1])
+                        col_a.write(f"**Amount:** ${bill['amount']}")
+                        col_b.write(f"**Date:** {bill['date']}")
+                        if col_c.button(f"💳 Pay", key=f"pay_{bill['id']}"):
+                            # Pay the bill
+                            try:
+                                pay_url = f"{BILLING_URL}/bills/pay"
+                                action = f"pay_{bill['id']}"
+                                pay_res = get_http().post(pay_url, json={"bill_id": bill['id']}, timeout=5,
+                                                          headers=idempotency_headers(action))
+                                settle_idempotency_key(action, pay_res)
+                                if pay_res.status_code == 200:
+                                    st.success("✅ Bill paid successfully!")
+                                    # Automatically refresh both views
+                                    refresh_dashboard()
+                                    st.rerun()
+                                else:
+                                    st.error("Payment failed")
+                            except Exception as e:
+                                st.error(f"Payment error: {str(e)}")
+                else:
+                    st.info("No pending bills.")
         
         # Paid Bills
         with col2:
             st.subheader("✅ Paid Bills")
-            if st.button("Refresh Paid Bills"):
-                st.session_state['show_paid'] = True
-            
-            if st.session_state.get('show_paid', False):
-                with st.spinner("Loading paid bills..."):
-                    try:
-                        url = f"{BILLING_URL}/bills/paid/{st.session_state['user_id']}"
-                        res = requests.get(url, timeout=5)
-                        if res.status_code == 200:
-                            data = res.json()
-                            if data:
-                                for bill in data:
-                                    st.write(f"💰 **${bill['amount']}** - Paid on {bill['date']}")
-                            else:
-                                st.info("No paid bills.")
-                        else:
-                            st.error(f"Error: {res.status_code}")
-                    except Exception as e:
-                        st.error(f"Could not fetch paid bills: {str(e)}")
+            paid = show_section('paid_bills', "paid bills")
+            if paid is not None:
+                if paid:
+                    for bill in paid:
+                        st.write(f"💰 **${bill['amount']}** - Paid on {bill['date']}")
+                else:
+                    st.info("No paid bills.")
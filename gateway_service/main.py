@@ -0,0 +1,73 @@
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+import asyncio
+import os
+import sys
+
+# Make the top-level shared/ package importable when running from this folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.clients import ServiceClient, ServiceUnavailable
+from shared.metrics import instrument
+from shared.pagination import MAX_PAGE_SIZE, NEXT_CURSOR_HEADER
+
+APPOINTMENT_SERVICE_URL = os.environ.get("APPOINTMENT_SERVICE_URL", "http://127.0.0.1:8002")
+BILLING_SERVICE_URL = os.environ.get("BILLING_SERVICE_URL", "http://127.0.0.1:8003")
+# Most rows one dashboard section collects; past that it is flagged as truncated
+DASHBOARD_MAX_ROWS = int(os.environ.get("DASHBOARD_MAX_ROWS", "5000"))
+
+# Pooled keep-alive clients; every call is bounded by a deadline and a circuit breaker
+appointment_client = ServiceClient(APPOINTMENT_SERVICE_URL, timeout=3.0)
+billing_client = ServiceClient(BILLING_SERVICE_URL, timeout=3.0)
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await appointment_client.aclose()
+    await billing_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
+# Latency/in-flight metrics on every route, served on /metrics
+instrument(app)
+
+async def fetch_section(client, path):
+    """Fetch one dashboard section, following its pages up to DASHBOARD_MAX_ROWS rows.
+    Returns (data, truncated, error)."""
+    rows = []
+    params = {"limit": min(MAX_PAGE_SIZE, DASHBOARD_MAX_ROWS)}
+    while True:
+        try:
+            response = await client.get(path, params=params)
+        except ServiceUnavailable as e:
+            print(f"ERROR in dashboard: {str(e)}")
+            return None, False, "Service unavailable"
+        if response.status_code != 200:
+            return None, False, f"HTTP {response.status_code}"
+        rows.extend(response.json())
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if cursor is None:
+            return rows, False, None
+        if len(rows) >= DASHBOARD_MAX_ROWS:
+            return rows, True, None
+        params = {"limit": min(MAX_PAGE_SIZE, DASHBOARD_MAX_ROWS - len(rows)), "after": cursor}
+
+@app.get("/dashboard/{patient_id}")
+async def get_dashboard(patient_id: int):
+    """A patient's appointments and bills in one call, fetched from both services concurrently"""
+    sections = {
+        "past": (appointment_client, f"/appointments/past/{patient_id}"),
+        "upcoming": (appointment_client, f"/appointments/upcoming/{patient_id}"),
+        "pending_bills": (billing_client, f"/bills/pending/{patient_id}"),
+        "paid_bills": (billing_client, f"/bills/paid/{patient_id}"),
+    }
+    results = await asyncio.gather(*(fetch_section(client, path) for client, path in sections.values()))
+
+    # A section whose service is down comes back as null, with the reason in "errors";
+    # one cut off at DASHBOARD_MAX_ROWS is listed in "truncated"
+    dashboard = {"patient_id": patient_id, "errors": {}, "truncated": {}}
+    for name, (data, truncated, error) in zip(sections, results):
+        dashboard[name] = data
+        if error:
+            dashboard["errors"][name] = error
+        if truncated:
+            dashboard["truncated"][name] = len(data)
+    return dashboard
@@ -1,23 +1,54 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-import sqlite3
+from pydantic import BaseModel, Field
+import hashlib
+import hmac
 import os
+import sys
 
-app = FastAPI()
+# Make the top-level shared/ package importable when running from this folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.cache import TTLCache
+from shared.idempotency import IdempotencyMiddleware
+from shared.metrics import instrument
+from shared.pagination import MAX_BULK_WRITES
+from patient_service.passwords import PasswordHasher
+from patient_service.repository import create_repository
 
-# Get the directory where this file is located
-DB_PATH = os.path.join(os.path.dirname(__file__), 'patients.db')
+# Get the directory where this file is located (the env var overrides it, e.g. for benchmarks)
+DB_PATH = os.environ.get("PATIENT_DB_PATH", os.path.join(os.path.dirname(__file__), 'patients.db'))
+# Set to a postgresql:// URL to store patients in PostgreSQL instead of DB_PATH
+DATABASE_URL = os.environ.get("PATIENT_DATABASE_URL", "")
+repo = create_repository(DATABASE_URL, DB_PATH)
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    c = conn.cursor()
-    # Added 'password' column
-    c.execute('''CREATE TABLE IF NOT EXISTS patients 
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, age INTEGER, password TEXT)''')
-    conn.commit()
-    conn.close()
+# Password hashing runs on its own bounded pool so a burst of logins can't
+# starve the threads that serve every other request
+hasher = PasswordHasher()
 
-init_db()
+# Successful logins are remembered briefly, so repeat calls with the same
+# credentials skip the KDF. Keys are HMACs under a per-process secret, never
+# the password itself.
+LOGIN_CACHE_TTL = float(os.environ.get("LOGIN_CACHE_TTL", "300"))
+verified_logins = TTLCache(maxsize=10000, ttl=LOGIN_CACHE_TTL)
+_login_cache_secret = os.urandom(32)
+
+def login_cache_key(name, password):
+    return hmac.new(_login_cache_secret, f"{name}\0{password}".encode(), hashlib.sha256).digest()
+
+@asynccontextmanager
+async def lifespan(app):
+    # Creates the tables on first run and applies any newer migrations
+    await repo.open()
+    yield
+    # Close pooled connections cleanly on shutdown
+    hasher.shutdown()
+    await repo.close()
+
+app = FastAPI(lifespan=lifespan)
+# Writes repeated with the same Idempotency-Key header replay the first response
+app.add_middleware(IdempotencyMiddleware)
+# Latency/in-flight metrics on every route, served on /metrics
+instrument(app)
 
 class RegisterRequest(BaseModel):
     name: str
@@ -28,37 +59,44 @@ class LoginRequest(BaseModel):
     name: str
     password: str
 
+class PatientBatchRequest(BaseModel):
+    ids: list[int] = Field(max_length=MAX_BULK_WRITES)
+
 @app.post("/register")
-def register(req: RegisterRequest):
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    c = conn.cursor()
-    c.execute("INSERT INTO patients (name, age, password) VALUES (?, ?, ?)", 
-              (req.name, req.age, req.password))
-    conn.commit()
-    patient_id = c.lastrowid
-    conn.close()
+async def register(req: RegisterRequest):
+    password_hash = await hasher.hash(req.password)
+    patient_id = await repo.insert_patient(req.name, req.age, password_hash)
     return {"message": "Registered successfully", "id": patient_id}
 
 @app.post("/login")
-def login(req: LoginRequest):
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    c = conn.cursor()
-    # Simple check (In real life, use hashing!)
-    c.execute("SELECT id, name FROM patients WHERE name=? AND password=?", (req.name, req.password))
-    user = c.fetchone()
-    conn.close()
-    
+async def login(req: LoginRequest):
+    cache_key = login_cache_key(req.name, req.password)
+    user = verified_logins.get(cache_key)
     if user:
         return {"id": user[0], "name": user[1]}
+
+    # Names aren't unique, so check the password against every match
+    for patient_id, name, stored in await repo.find_by_name(req.name):
+        if not await hasher.verify(req.password, stored):
+            continue
+        # Upgrade plaintext rows (and hashes made with an old cost factor)
+        if hasher.needs_rehash(stored):
+            new_hash = await hasher.hash(req.password)
+            await repo.update_password_hash(patient_id, stored, new_hash)
+        verified_logins.set(cache_key, (patient_id, name))
+        return {"id": patient_id, "name": name}
+
     raise HTTPException(status_code=401, detail="Invalid credentials")
 
 @app.get("/patients/{patient_id}")
-def get_patient(patient_id: int):
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    c = conn.cursor()
-    c.execute("SELECT id, name, age FROM patients WHERE id=?", (patient_id,))
-    patient = c.fetchone()
-    conn.close()
+async def get_patient(patient_id: int):
+    patient = await repo.get_patient(patient_id)
     if patient:
         return {"id": patient[0], "name": patient[1], "age": patient[2]}
-    raise HTTPException(status_code=404, detail="Patient not found")
\ No newline at end of file
+    raise HTTPException(status_code=404, detail="Patient not found")
+
+@app.post("/patients/batch")
+async def get_existing_patients(req: PatientBatchRequest):
+    """Which of the given patient ids exist, checked in one lookup"""
+    existing = await repo.existing_ids(list(dict.fromkeys(req.ids)))
+    return {"existing": existing}
@@ -0,0 +1,73 @@
+"""Password hashing for patient logins.
+
+Passwords are stored as ``pbkdf2_sha256$<iterations>$<salt>$<hash>``. The KDF is
+deliberately slow, so it runs on a dedicated, size-limited thread pool
+(``hashlib`` releases the GIL while it works) rather than on the event loop or
+FastAPI's shared request threadpool.
+
+Rows written before hashing was introduced still hold the plaintext password;
+``verify`` accepts those and ``needs_rehash`` flags them so the caller can
+upgrade the row on the next successful login.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+ALGORITHM = "pbkdf2_sha256"
+# Cost factor; raising it makes stored hashes re-hash on their next login
+ITERATIONS = int(os.environ.get("PASSWORD_HASH_ITERATIONS", "200000"))
+WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+
+def is_hashed(stored):
+    return stored is not None and stored.startswith(ALGORITHM + "$")
+
+
+def hash_password(password, iterations=ITERATIONS):
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return "$".join([ALGORITHM, str(iterations),
+                     base64.b64encode(salt).decode(), base64.b64encode(digest).decode()])
+
+
+def verify_password(password, stored):
+    if stored is None:
+        return False
+    if not is_hashed(stored):
+        # Legacy plaintext row
+        return hmac.compare_digest(password.encode(), stored.encode())
+    _, iterations, salt, expected = stored.split("$")
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), base64.b64decode(salt), int(iterations))
+    return hmac.compare_digest(digest, base64.b64decode(expected))
+
+
+def needs_rehash(stored, iterations=ITERATIONS):
+    return not is_hashed(stored) or int(stored.split("$")[1]) != iterations
+
+
+class PasswordHasher:
+    """Runs hashing and verification on a bounded pool of worker threads."""
+
+    def __init__(self, workers=WORKERS, iterations=ITERATIONS):
+        self.iterations = iterations
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kdf")
+
+    async def hash(self, password):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, hash_password, password, self.iterations)
+
+    async def verify(self, password, stored):
+        if not is_hashed(stored):
+            # Plaintext comparison is cheap, no need to queue it
+            return verify_password(password, stored)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, verify_password, password, stored)
+
+    def needs_rehash(self, stored):
+        return needs_rehash(stored, self.iterations)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
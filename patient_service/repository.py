@@ -0,0 +1,81 @@
+"""Storage for patients, on SQLite or PostgreSQL (see ``shared.repository``)."""
+from shared.pagination import chunks, placeholders
+from shared.repository import PostgresRepository, SqliteRepository, blocking, is_postgres_url
+from patient_service.schema import MIGRATIONS, POSTGRES_MIGRATIONS
+
+
+class SqlitePatientRepository(SqliteRepository):
+
+    def __init__(self, path, **db_options):
+        super().__init__(path, MIGRATIONS, **db_options)
+
+    @blocking
+    def insert_patient(self, name, age, password_hash):
+        with self.db.connection() as conn:
+            c = conn.cursor()
+            c.execute("INSERT INTO patients (name, age, password) VALUES (?, ?, ?)",
+                      (name, age, password_hash))
+            conn.commit()
+            return c.lastrowid
+
+    @blocking
+    def find_by_name(self, name):
+        """(id, name, stored password) of every patient with this name"""
+        with self.db.connection() as conn:
+            return conn.execute("SELECT id, name, password FROM patients WHERE name=?", (name,)).fetchall()
+
+    @blocking
+    def update_password_hash(self, patient_id, old_value, new_hash):
+        with self.db.connection() as conn:
+            # Only replace the value we verified, in case it changed meanwhile
+            conn.execute("UPDATE patients SET password=? WHERE id=? AND password=?",
+                         (new_hash, patient_id, old_value))
+            conn.commit()
+
+    @blocking
+    def get_patient(self, patient_id):
+        """(id, name, age), or None"""
+        with self.db.connection() as conn:
+            return conn.execute("SELECT id, name, age FROM patients WHERE id=?", (patient_id,)).fetchone()
+
+    @blocking
+    def existing_ids(self, ids):
+        existing = []
+        with self.db.connection() as conn:
+            for chunk in chunks(ids):
+                c = conn.execute(f"SELECT id FROM patients WHERE id IN ({placeholders(len(chunk))})", chunk)
+                existing.extend(r[0] for r in c)
+        return existing
+
+
+class PostgresPatientRepository(PostgresRepository):
+
+    def __init__(self, url, **pool_options):
+        super().__init__(url, "patients", POSTGRES_MIGRATIONS, **pool_options)
+
+    async def insert_patient(self, name, age, password_hash):
+        return await self.pool.fetchval("INSERT INTO patients (name, age, password) VALUES ($1, $2, $3) RETURNING id",
+                                        name, age, password_hash)
+
+    async def find_by_name(self, name):
+        rows = await self.pool.fetch("SELECT id, name, password FROM patients WHERE name=$1", name)
+        return [tuple(r) for r in rows]
+
+    async def update_password_hash(self, patient_id, old_value, new_hash):
+        await self.pool.execute("UPDATE patients SET password=$1 WHERE id=$2 AND password=$3",
+                                new_hash, patient_id, old_value)
+
+    async def get_patient(self, patient_id):
+        row = await self.pool.fetchrow("SELECT id, name, age FROM patients WHERE id=$1", patient_id)
+        return tuple(row) if row else None
+
+    async def existing_ids(self, ids):
+        rows = await self.pool.fetch("SELECT id FROM patients WHERE id = ANY($1::bigint[])", ids)
+        return [r[0] for r in rows]
+
+
+def create_repository(url, path):
+    """PostgreSQL if ``url`` is a postgresql:// URL, otherwise the SQLite file at ``path``"""
+    if is_postgres_url(url):
+        return PostgresPatientRepository(url)
+    return SqlitePatientRepository(path)
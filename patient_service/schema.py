@@ -0,0 +1,23 @@
+"""Schema migrations for patients.db (and the PostgreSQL backend). Append new versions; never edit old ones."""
+
+MIGRATIONS = [
+    # 1: original table
+    '''CREATE TABLE IF NOT EXISTS patients
+       (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, age INTEGER, password TEXT);''',
+
+    # 2: login looks patients up by (name, password); covers the returned id
+    '''CREATE INDEX IF NOT EXISTS idx_patients_name_password ON patients (name, password);''',
+
+    # 3: passwords are now salted hashes, so login looks patients up by name only
+    '''DROP INDEX IF EXISTS idx_patients_name_password;
+       CREATE INDEX IF NOT EXISTS idx_patients_name ON patients (name);''',
+]
+
+# PostgreSQL starts from the current shape of the schema above; later changes
+# get appended to both lists.
+POSTGRES_MIGRATIONS = [
+    # 1: patients, looked up by name at login
+    '''CREATE TABLE IF NOT EXISTS patients
+       (id BIGSERIAL PRIMARY KEY, name TEXT, age INTEGER, password TEXT);
+       CREATE INDEX IF NOT EXISTS idx_patients_name ON patients (name);''',
+]
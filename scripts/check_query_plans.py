@@ -0,0 +1,129 @@
+"""Query-plan regression check for the services' hot lookups.
+
+Builds each service's schema in memory from its migrations and runs
+``EXPLAIN QUERY PLAN`` on the queries the request handlers issue. Any full
+table scan, or a plan that stops using the expected index, fails the check.
+
+Run from the repository root:
+
+    python scripts/check_query_plans.py
+
+Keep the SQL below in sync with the SQLite repository in each service's repository.py.
+"""
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.migrations import migrate
+from patient_service.schema import MIGRATIONS as PATIENT_MIGRATIONS
+from appointment_service.schema import MIGRATIONS as APPOINTMENT_MIGRATIONS
+from billing_service.schema import MIGRATIONS as BILLING_MIGRATIONS
+
+# (service migrations, description, sql, params, index that must be used)
+CHECKS = [
+    (PATIENT_MIGRATIONS, "login",
+     "SELECT id, name, password FROM patients WHERE name=?",
+     ("a",), "idx_patients_name"),
+    (PATIENT_MIGRATIONS, "get_patient",
+     "SELECT id, name, age FROM patients WHERE id=?",
+     (1,), "INTEGER PRIMARY KEY"),
+
+    (APPOINTMENT_MIGRATIONS, "get_history",
+     "SELECT doctor, date, time_slot, id FROM appointments WHERE patient_id=? ORDER BY date, id LIMIT ?",
+     (1, 100), "idx_appointments_patient_date"),
+    (APPOINTMENT_MIGRATIONS, "get_history next page",
+     "SELECT doctor, date, time_slot, id FROM appointments WHERE patient_id=? AND (date, id) > (?, ?) ORDER BY date, id LIMIT ?",
+     (1, "2025-01-01", 5, 100), "idx_appointments_patient_date"),
+    (APPOINTMENT_MIGRATIONS, "get_past_appointments next page",
+     "SELECT doctor, date, time_slot, id FROM appointments WHERE patient_id=? AND date < ? AND (date, id) < (?, ?) "
+     "ORDER BY date DESC, id DESC LIMIT ?",
+     (1, "2025-01-01", "2024-06-01", 5, 100), "idx_appointments_patient_date"),
+    (APPOINTMENT_MIGRATIONS, "get_upcoming_appointments next page",
+     "SELECT doctor, date, time_slot, id FROM appointments WHERE patient_id=? AND date >= ? AND (date, id) > (?, ?) "
+     "ORDER BY date ASC, id ASC LIMIT ?",
+     (1, "2025-01-01", "2025-02-01", 5, 100), "idx_appointments_patient_date"),
+    (APPOINTMENT_MIGRATIONS, "appointments_range by doctor next page",
+     "SELECT id, patient_id, doctor, date, time_slot, starts_at FROM appointments "
+     "WHERE starts_at >= ? AND starts_at < ? AND doctor=? AND (starts_at, id) > (?, ?) ORDER BY starts_at, id LIMIT ?",
+     ("2025-01-01T00:00", "2025-02-01T00:00", "Dr. A", "2025-01-10T09:00", 5, 100), "idx_appointments_doctor_starts"),
+    (APPOINTMENT_MIGRATIONS, "appointments_range by patient",
+     "SELECT id, patient_id, doctor, date, time_slot, starts_at FROM appointments "
+     "WHERE starts_at >= ? AND starts_at < ? AND patient_id=? ORDER BY starts_at, id LIMIT ?",
+     ("2025-01-01T00:00", "2026-01-01T00:00", 1, 100), "idx_appointments_patient_starts"),
+    (APPOINTMENT_MIGRATIONS, "appointments_range all doctors",
+     "SELECT id, patient_id, doctor, date, time_slot, starts_at FROM appointments "
+     "WHERE starts_at >= ? AND starts_at < ? ORDER BY starts_at, id LIMIT ?",
+     ("2025-01-01T00:00", "2025-01-08T00:00", 100), "idx_appointments_starts"),
+    (APPOINTMENT_MIGRATIONS, "availability index load",
+     "SELECT doctor, date, time_slot FROM appointments WHERE starts_at >= ?",
+     ("2025-01-01T00:00",), "idx_appointments_starts"),
+    (APPOINTMENT_MIGRATIONS, "utilization",
+     "SELECT doctor, date, COUNT(*) FROM appointments WHERE doctor IN (?, ?) AND date >= ? AND date <= ? "
+     "GROUP BY doctor, date ORDER BY doctor, date",
+     ("Dr. A", "Dr. B", "2025-01-01", "2025-12-31"), "idx_appointments_slot"),
+
+    (BILLING_MIGRATIONS, "get_bills next page",
+     "SELECT id, amount, status, date_generated FROM bills WHERE patient_id=? AND id > ? ORDER BY id LIMIT ?",
+     (1, 5, 100), "idx_bills_patient"),
+    (BILLING_MIGRATIONS, "get_pending_bills next page",
+     "SELECT id, amount, status, date_generated FROM bills WHERE patient_id=? AND status=? AND id > ? ORDER BY id LIMIT ?",
+     (1, "PENDING", 5, 100), "idx_bills_patient_status"),
+    (BILLING_MIGRATIONS, "get_paid_bills",
+     "SELECT id, amount, status, date_generated FROM bills WHERE patient_id=? AND status=? ORDER BY id LIMIT ?",
+     (1, "PAID", 100), "idx_bills_patient_status"),
+    (BILLING_MIGRATIONS, "pay_bill",
+     "UPDATE bills SET status='PAID', date_paid=? WHERE id=?",
+     ("2025-01-01", 1), "INTEGER PRIMARY KEY"),
+    (BILLING_MIGRATIONS, "get_patient_summary",
+     "SELECT pending_count, pending_amount, paid_count, paid_amount FROM patient_balances WHERE patient_id=?",
+     (1,), "INTEGER PRIMARY KEY"),
+    (BILLING_MIGRATIONS, "get_daily_totals",
+     "SELECT day, billed_count, billed_amount, paid_count, paid_amount FROM daily_totals "
+     "WHERE day >= ? AND day <= ? ORDER BY day",
+     ("2025-01-01", "2025-01-31"), "sqlite_autoindex_daily_totals_1"),
+]
+
+
+def query_plan(conn, sql, params):
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def check_plan(plan, expected_index):
+    """Return a list of problems with a plan (empty if it is fine)."""
+    problems = []
+    for step in plan:
+        # "SCAN table" is a full scan; "SCAN ... USING INDEX" walks a whole index
+        if step.startswith("SCAN"):
+            problems.append(f"scan: {step}")
+        if "TEMP B-TREE" in step:
+            problems.append(f"sort without index: {step}")
+    if not any(expected_index in step for step in plan):
+        problems.append(f"expected {expected_index}, got {plan}")
+    return problems
+
+
+def main():
+    databases = {}
+    failures = 0
+    for migrations, name, sql, params, expected_index in CHECKS:
+        conn = databases.get(id(migrations))
+        if conn is None:
+            conn = sqlite3.connect(":memory:")
+            migrate(conn, migrations)
+            databases[id(migrations)] = conn
+
+        plan = query_plan(conn, sql, params)
+        problems = check_plan(plan, expected_index)
+        status = "FAIL" if problems else "ok"
+        print(f"[{status}] {name}: {' | '.join(plan)}")
+        for problem in problems:
+            print(f"       {problem}")
+        failures += bool(problems)
+
+    print(f"\n{len(CHECKS) - failures}/{len(CHECKS)} query plans use their index")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
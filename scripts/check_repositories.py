@@ -0,0 +1,344 @@
+"""Conformance check for the storage backends behind each service.
+
+Runs the same checks against every repository implementation, so the SQLite
+and PostgreSQL backends are held to identical behaviour: return values,
+ordering, paging, conflict handling and idempotency. SQLite always runs, on
+temporary files. PostgreSQL runs when ``CHECK_DATABASE_URL`` points at a
+server (a local one or a throwaway container); each run uses a fresh schema
+that is dropped afterwards.
+
+    python scripts/check_repositories.py
+    CHECK_DATABASE_URL=postgresql://postgres@localhost/postgres python scripts/check_repositories.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import traceback
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from patient_service.repository import PostgresPatientRepository, SqlitePatientRepository
+from appointment_service.repository import PostgresAppointmentRepository, SqliteAppointmentRepository
+from billing_service.repository import PostgresBillRepository, SqliteBillRepository
+
+CHECKS = []
+
+
+def check(service):
+    def register(fn):
+        CHECKS.append((service, fn))
+        return fn
+    return register
+
+
+def expect(actual, expected, what):
+    if actual != expected:
+        raise AssertionError(f"{what}: expected {expected!r}, got {actual!r}")
+
+
+async def collect(batches):
+    rows = []
+    async for batch in batches:
+        rows.extend(tuple(r) for r in batch)
+    return rows
+
+
+@check("patients")
+async def patients_register_and_login(repo):
+    first = await repo.insert_patient("ana", 30, "hash-1")
+    second = await repo.insert_patient("ana", 41, "hash-2")
+    expect(second > first, True, "ids increase")
+    expect(sorted(await repo.find_by_name("ana")), [(first, "ana", "hash-1"), (second, "ana", "hash-2")],
+           "patients by name")
+    expect(await repo.find_by_name("nobody"), [], "unknown name")
+    expect(await repo.get_patient(first), (first, "ana", 30), "get_patient")
+    expect(await repo.get_patient(first + 1000), None, "missing patient")
+
+
+@check("patients")
+async def patients_rehash_only_replaces_verified_value(repo):
+    patient_id = await repo.insert_patient("bo", 50, "plain")
+    await repo.update_password_hash(patient_id, "stale", "new-hash")
+    expect((await repo.find_by_name("bo"))[0][2], "plain", "update with a stale old value")
+    await repo.update_password_hash(patient_id, "plain", "new-hash")
+    expect((await repo.find_by_name("bo"))[0][2], "new-hash", "update with the verified value")
+
+
+@check("patients")
+async def patients_existing_ids(repo):
+    ids = [await repo.insert_patient(f"p{i}", 20, "h") for i in range(3)]
+    expect(sorted(await repo.existing_ids(ids + [ids[-1] + 1000])), ids, "existing ids")
+    expect(await repo.existing_ids([]), [], "no ids")
+
+
+@check("appointments")
+async def appointments_one_booking_per_slot(repo):
+    expect(await repo.book_slot(1, "Dr. A", "2030-01-01", "09:00"), True, "first booking")
+    expect(await repo.book_slot(2, "Dr. A", "2030-01-01", "09:00"), False, "same slot again")
+    expect(await repo.book_slot(2, "Dr. B", "2030-01-01", "09:00"), True, "other doctor, same time")
+    await repo.book_slot(3, "Dr. A", "2029-12-31", "09:00")
+    expect(sorted(await collect(repo.booked_slots("2030-01-01", batch_size=1))),
+           [("Dr. A", "2030-01-01", "09:00"), ("Dr. B", "2030-01-01", "09:00")], "booked slots from a day on")
+
+    due = await repo.due_bills(float("inf"), 10)
+    expect(sorted((key.split("-")[0], patient_id, attempts) for _, key, patient_id, attempts in due),
+           [("appointment", 1, 0), ("appointment", 2, 0), ("appointment", 3, 0)], "one queued bill per booking")
+
+
+@check("appointments")
+async def appointments_concurrent_bookings(repo):
+    results = await asyncio.gather(*(repo.book_slot(i, "Dr. A", "2030-02-01", "10:00") for i in range(20)))
+    expect(results.count(True), 1, "winners among 20 concurrent bookings of one slot")
+    expect(len(await repo.due_bills(float("inf"), 100)), 1, "bills queued")
+
+
+@check("appointments")
+async def appointments_bulk_booking(repo):
+    await repo.book_slot(9, "Dr. A", "2030-03-01", "09:00")
+    booked = await repo.book_slots([
+        (1, "Dr. A", "2030-03-01", "09:00"),  # already taken
+        (2, "Dr. A", "2030-03-01", "10:00"),
+        (3, "Dr. A", "2030-03-01", "10:00"),  # repeats the previous item
+        (4, "Dr. B", "2030-03-01", "10:00"),
+    ])
+    expect(booked, {1, 3}, "booked positions")
+    expect(await repo.book_slots([]), set(), "empty batch")
+    expect(len(await repo.due_bills(float("inf"), 100)), 3, "bills queued")
+
+
+@check("appointments")
+async def appointments_lists_and_paging(repo):
+    days = ["2030-01-05", "2030-01-01", "2030-01-03", "2030-01-02", "2030-01-04"]
+    for day in days:
+        await repo.book_slot(7, "Dr. A", day, "09:00")
+    await repo.book_slot(8, "Dr. A", "2030-01-06", "09:00")
+
+    history = await repo.list_appointments("history", 7, None, 100)
+    expect([r[1] for r in history], sorted(days), "history in date order")
+    first_page = await repo.list_appointments("history", 7, None, 2)
+    next_page = await repo.list_appointments("history", 7, None, 2, (first_page[-1][1], first_page[-1][3]))
+    expect([r[1] for r in first_page + next_page], sorted(days)[:4], "history pages")
+
+    past = await repo.list_appointments("past", 7, "2030-01-03", 100)
+    expect([r[1] for r in past], ["2030-01-02", "2030-01-01"], "past, newest first")
+    upcoming = await repo.list_appointments("upcoming", 7, "2030-01-03", 2)
+    expect([r[1] for r in upcoming], ["2030-01-03", "2030-01-04"], "upcoming, soonest first")
+    after = (upcoming[-1][1], upcoming[-1][3])
+    expect([r[1] for r in await repo.list_appointments("upcoming", 7, "2030-01-03", 2, after)],
+           ["2030-01-05"], "upcoming next page")
+
+    bulk = await repo.history_for_patients([7, 8, 99])
+    expect(sorted((r[3], r[1]) for r in bulk), sorted([(7, d) for d in days] + [(8, "2030-01-06")]),
+           "history for many patients")
+
+
+@check("appointments")
+async def appointments_export(repo):
+    for day in ["2030-01-01", "2030-01-02", "2030-01-03"]:
+        await repo.book_slot(1, "Dr. A", day, "09:00")
+    rows = await collect(repo.export(batch_size=2))
+    expect([r[3] for r in rows], ["2030-01-01", "2030-01-02", "2030-01-03"], "export in id order")
+    expect(rows[0][1:], (1, "Dr. A", "2030-01-01", "09:00"), "export columns")
+    expect([r[3] for r in await collect(repo.export("2030-01-02", "2030-01-02"))], ["2030-01-02"], "export range")
+
+
+@check("appointments")
+async def appointments_time_ranges(repo):
+    await repo.book_slot(1, "Dr. A", "2030-01-01", "14:00")
+    await repo.book_slot(2, "Dr. A", "2030-01-01", "09:00")
+    await repo.book_slot(1, "Dr. B", "2030-01-01", "09:00")
+    await repo.book_slot(1, "Dr. A", "2030-01-02", "09:00")
+    await repo.book_slot(3, "Dr. A", "2030-01-08", "09:00")
+
+    week = await repo.appointments_between("2030-01-01T00:00", "2030-01-08T00:00", 100)
+    expect([(r[5], r[2]) for r in week],
+           [("2030-01-01T09:00", "Dr. A"), ("2030-01-01T09:00", "Dr. B"), ("2030-01-01T14:00", "Dr. A"),
+            ("2030-01-02T09:00", "Dr. A")], "range in start-time order, end excluded")
+    expect(week[0][1:5], (2, "Dr. A", "2030-01-01", "09:00"), "range columns")
+    doctor = await repo.appointments_between("2030-01-01T00:00", "2030-01-09T00:00", 2, doctor="Dr. A")
+    rest = await repo.appointments_between("2030-01-01T00:00", "2030-01-09T00:00", 2, doctor="Dr. A",
+                                           after=(doctor[-1][5], doctor[-1][0]))
+    expect([r[5] for r in doctor + rest],
+           ["2030-01-01T09:00", "2030-01-01T14:00", "2030-01-02T09:00", "2030-01-08T09:00"], "doctor range pages")
+    patient = await repo.appointments_between("2030-01-01T10:00", "2030-02-01T00:00", 100, patient_id=1)
+    expect([(r[2], r[5]) for r in patient], [("Dr. A", "2030-01-01T14:00"), ("Dr. A", "2030-01-02T09:00")],
+           "patient range from mid-morning")
+    expect(await repo.appointments_between("2030-01-01T00:00", "2030-01-08T00:00", 100, "Dr. B", 2), [],
+           "doctor and patient together")
+
+    expect(await repo.booked_per_day(["Dr. A", "Dr. B", "Dr. C"], "2030-01-01", "2030-01-02"),
+           [("Dr. A", "2030-01-01", 2), ("Dr. A", "2030-01-02", 1), ("Dr. B", "2030-01-01", 1)], "booked per day")
+
+
+@check("appointments")
+async def appointments_outbox_retry(repo):
+    await repo.book_slot(1, "Dr. A", "2030-01-01", "09:00")
+    await repo.book_slot(2, "Dr. A", "2030-01-01", "10:00")
+    first, second = sorted(await repo.due_bills(1000.0, 10))
+    await repo.reschedule_bills([(5000.0, first[0])])
+    expect([r[0] for r in await repo.due_bills(1000.0, 10)], [second[0]], "rescheduled row is not due yet")
+    expect((await repo.due_bills(6000.0, 10))[-1][3], 1, "attempts counted")
+    await repo.delete_bills([first[0], second[0]])
+    expect(await repo.due_bills(float("inf"), 10), [], "delivered rows deleted")
+
+
+@check("bills")
+async def bills_generate_and_dedupe(repo):
+    await repo.create_bill(1, 150.0, "2030-01-01")
+    created = await repo.create_bills([(1, "appointment-1"), (2, "appointment-2"), (2, "appointment-2")],
+                                      150.0, "2030-01-02")
+    expect(created, 2, "bills created from a batch with a repeated key")
+    expect(await repo.create_bills([(1, "appointment-1")], 150.0, "2030-01-02"), 0, "resent batch")
+    expect(await repo.create_bills([], 150.0, "2030-01-02"), 0, "empty batch")
+    expect([r[1:] for r in await repo.list_bills(1, None, 100)],
+           [(150.0, "PENDING", "2030-01-01"), (150.0, "PENDING", "2030-01-02")], "patient 1 bills")
+
+
+@check("bills")
+async def bills_pay_and_filter(repo):
+    for _ in range(3):
+        await repo.create_bill(5, 150.0, "2030-01-01")
+    ids = [r[0] for r in await repo.list_bills(5, None, 100)]
+    expect(await repo.pay_bill(ids[0], "2030-01-02"), 5, "pay_bill returns the owner")
+    expect(await repo.pay_bill(ids[-1] + 1000, "2030-01-02"), None, "paying a missing bill")
+    expect([r[0] for r in await repo.list_bills(5, "PAID", 100)], ids[:1], "paid bills")
+    expect([r[0] for r in await repo.list_bills(5, "PENDING", 1)], ids[1:2], "first pending page")
+    expect([r[0] for r in await repo.list_bills(5, "PENDING", 1, ids[1])], ids[2:], "next pending page")
+
+    found, to_pay = await repo.pay_bills([ids[0], ids[1], ids[-1] + 1000], "2030-01-02")
+    expect(found, {ids[0]: ("PAID", 5), ids[1]: ("PENDING", 5)}, "bulk pay lookup")
+    expect(to_pay, [ids[1]], "bulk pay pays only pending bills")
+    expect([r[0] for r in await repo.list_bills(5, "PENDING", 100)], ids[2:], "pending after bulk pay")
+
+
+@check("bills")
+async def bills_for_many_patients_and_export(repo):
+    for patient_id in (1, 2, 1):
+        await repo.create_bill(patient_id, 150.0, f"2030-01-0{patient_id}")
+    rows = await repo.bills_for_patients([1, 2, 3])
+    expect(sorted(r[4] for r in rows), [1, 1, 2], "bills for many patients")
+    expect(len(await repo.bills_for_patients([1, 2], "PAID")), 0, "status filter")
+    exported = await collect(repo.export(batch_size=2))
+    expect([r[1] for r in exported], [1, 2, 1], "export in id order")
+    expect([r[1] for r in await collect(repo.export(start="2030-01-02"))], [2], "export range")
+
+
+@check("bills")
+async def bills_summaries_follow_writes(repo):
+    await repo.create_bill(1, 100.0, "2030-01-01")
+    await repo.create_bills([(1, "k-1"), (2, "k-2")], 150.0, "2030-01-01")
+    await repo.create_bills([(2, "k-2")], 150.0, "2030-01-02")  # duplicate, not billed again
+    ids = [r[0] for r in await repo.list_bills(1, None, 100)]
+    await repo.pay_bill(ids[0], "2030-01-03")
+    await repo.pay_bill(ids[0], "2030-01-04")  # already paid, not counted again
+    await repo.pay_bills([ids[1], ids[1]], "2030-01-03")
+
+    expect(await repo.patient_summary(1), (0, 0.0, 2, 250.0), "patient 1 balance")
+    expect(await repo.patient_summary(2), (1, 150.0, 0, 0.0), "patient 2 balance")
+    expect(await repo.patient_summary(3), None, "patient without bills")
+    daily = await repo.daily_totals("2030-01-01", "2030-01-31")
+    expect(daily, [("2030-01-01", 3, 400.0, 0, 0.0), ("2030-01-03", 0, 0.0, 2, 250.0)], "daily totals")
+    expect(await repo.daily_totals("2030-01-02", "2030-01-02"), [], "day without activity")
+
+    # A rebuild from the bills must land on exactly the incrementally kept totals
+    expect(await repo.rebuild_summaries(), (2, 2), "rows rebuilt")
+    expect(await repo.patient_summary(1), (0, 0.0, 2, 250.0), "patient 1 balance after rebuild")
+    expect(await repo.daily_totals("2030-01-01", "2030-01-31"), daily, "daily totals after rebuild")
+
+
+REPOSITORIES = {
+    "sqlite": {
+        "patients": SqlitePatientRepository,
+        "appointments": SqliteAppointmentRepository,
+        "bills": SqliteBillRepository,
+    },
+    "postgres": {
+        "patients": PostgresPatientRepository,
+        "appointments": PostgresAppointmentRepository,
+        "bills": PostgresBillRepository,
+    },
+}
+
+
+class SqliteBackend:
+    """Each check gets its own database file, so they start empty"""
+
+    def __init__(self, tmp):
+        self.tmp = tmp
+
+    async def create(self, cls):
+        return cls(os.path.join(self.tmp, f"{uuid.uuid4().hex}.db"))
+
+    async def cleanup(self):
+        pass
+
+
+class PostgresBackend:
+    """Each check gets its own schema, so they start empty and can't interfere"""
+
+    def __init__(self, url):
+        self.url = url
+        self.schemas = []
+
+    async def _execute(self, sql):
+        import asyncpg
+
+        conn = await asyncpg.connect(self.url)
+        try:
+            await conn.execute(sql)
+        finally:
+            await conn.close()
+
+    async def create(self, cls):
+        schema = f"conformance_{uuid.uuid4().hex[:12]}"
+        await self._execute(f"CREATE SCHEMA {schema}")
+        self.schemas.append(schema)
+        return cls(self.url, server_settings={"search_path": schema})
+
+    async def cleanup(self):
+        for schema in self.schemas:
+            await self._execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+
+
+async def run_backend(name, backend):
+    failures = 0
+    try:
+        for service, fn in CHECKS:
+            repo = await backend.create(REPOSITORIES[name][service])
+            try:
+                await repo.open()
+                await fn(repo)
+                print(f"[ok] {name} {service}: {fn.__name__}")
+            except Exception:
+                failures += 1
+                print(f"[FAIL] {name} {service}: {fn.__name__}")
+                print("       " + traceback.format_exc().strip().replace("\n", "\n       "))
+            finally:
+                await repo.close()
+    finally:
+        await backend.cleanup()
+    return failures
+
+
+async def main():
+    backends = []
+    with tempfile.TemporaryDirectory() as tmp:
+        backends.append(("sqlite", SqliteBackend(tmp)))
+        url = os.environ.get("CHECK_DATABASE_URL")
+        if url:
+            backends.append(("postgres", PostgresBackend(url)))
+        else:
+            print("CHECK_DATABASE_URL not set, skipping PostgreSQL\n")
+
+        failures = 0
+        for name, backend in backends:
+            failures += await run_backend(name, backend)
+
+    total = len(CHECKS) * len(backends)
+    print(f"\n{total - failures}/{total} repository checks passed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,45 @@
+"""Recompute the billing summary tables from the bills table.
+
+Bill writes keep ``patient_balances`` and ``daily_totals`` current as they
+happen; this rebuilds both from scratch in one transaction, e.g. after bills
+were imported or edited outside the service. Uses the same storage settings as
+the billing service:
+
+    python scripts/rebuild_billing_summaries.py
+    BILLING_DATABASE_URL=postgresql://... python scripts/rebuild_billing_summaries.py
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from billing_service.repository import create_repository
+
+
+async def rebuild(url, path):
+    repo = create_repository(url, path)
+    await repo.open()
+    try:
+        start = time.perf_counter()
+        patients, days = await repo.rebuild_summaries()
+        elapsed = time.perf_counter() - start
+    finally:
+        await repo.close()
+    print(f"Rebuilt balances for {patients} patients and totals for {days} days in {elapsed:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=os.environ.get("BILLING_DB_PATH", os.path.join(ROOT, "billing_service", "billing.db")),
+                        help="SQLite database file")
+    parser.add_argument("--url", default=os.environ.get("BILLING_DATABASE_URL", ""),
+                        help="postgresql:// URL; takes precedence over --db")
+    args = parser.parse_args()
+    asyncio.run(rebuild(args.url, args.db))
+
+
+if __name__ == "__main__":
+    main()
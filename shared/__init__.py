@@ -0,0 +1 @@
+"""Code shared by the patient, appointment and billing services."""
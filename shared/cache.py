@@ -0,0 +1,211 @@
+"""Small in-process caches with hit/miss counters."""
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """A size-bounded LRU cache whose entries also expire after a TTL.
+
+    ``ttl`` is the default lifetime in seconds; ``set`` can override it per
+    entry (e.g. a shorter TTL for negative results). Thread-safe, since sync
+    FastAPI handlers run on a threadpool.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def approx_size(value):
+    """Rough deep size in bytes of a cached result (lists/tuples/dicts of scalars)"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(approx_size(v) for v in value)
+    return size
+
+
+class ReadThroughCache:
+    """Query results grouped per owner (e.g. a patient), with LRU eviction by owner.
+
+    ``get_or_load(owner, key, loader)`` returns the cached result for one query
+    of that owner or calls ``loader()`` and stores what it returns. A write calls
+    ``invalidate(owner)`` to drop every cached query of that owner at once; other
+    owners keep their entries. At most ``maxsize`` owners are kept, and entries
+    also expire after ``ttl`` as a backstop for writes made by other processes.
+
+    A load that overlaps an invalidation of the same owner is returned but not
+    stored, so a read racing a write can never cache the pre-write result.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.bytes = 0
+        self._data = OrderedDict()  # owner -> {key: (expires_at, size, value)}
+        self._generations = {}  # owner -> invalidation count, only while a load is running
+        self._loading = {}  # owner -> loads in progress
+        self._lock = threading.Lock()
+
+    def get_or_load(self, owner, key, loader):
+        found, value, generation = self._lookup(owner, key)
+        if found:
+            return value
+        try:
+            value = loader()
+        except BaseException:
+            self._abandon(owner)
+            raise
+        self._finish(owner, key, value, generation)
+        return value
+
+    async def aget_or_load(self, owner, key, loader):
+        """Same as ``get_or_load`` for a loader that returns an awaitable"""
+        found, value, generation = self._lookup(owner, key)
+        if found:
+            return value
+        try:
+            value = await loader()
+        except BaseException:
+            self._abandon(owner)
+            raise
+        self._finish(owner, key, value, generation)
+        return value
+
+    def _lookup(self, owner, key):
+        """(True, value, None) on a hit; on a miss (False, None, generation) and a load is registered"""
+        with self._lock:
+            entries = self._data.get(owner)
+            entry = entries.get(key) if entries else None
+            if entry is not None:
+                expires_at, size, value = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(owner)
+                    self.hits += 1
+                    return True, value, None
+                del entries[key]
+                self.bytes -= size
+            self.misses += 1
+            self._loading[owner] = self._loading.get(owner, 0) + 1
+            return False, None, self._generations.setdefault(owner, 0)
+
+    def _finish(self, owner, key, value, generation):
+        size = approx_size(value)
+        with self._lock:
+            if self._generations[owner] == generation:
+                self._store(owner, key, value, size)
+            self._done_loading(owner)
+
+    def _abandon(self, owner):
+        with self._lock:
+            self._done_loading(owner)
+
+    def _done_loading(self, owner):
+        self._loading[owner] -= 1
+        if not self._loading[owner]:
+            del self._loading[owner]
+            del self._generations[owner]
+
+    def _store(self, owner, key, value, size):
+        entries = self._data.setdefault(owner, {})
+        old = entries.get(key)
+        if old is not None:
+            self.bytes -= old[1]
+        entries[key] = (time.monotonic() + self.ttl, size, value)
+        self.bytes += size
+        self._data.move_to_end(owner)
+        while len(self._data) > self.maxsize:
+            _, evicted = self._data.popitem(last=False)
+            self.bytes -= sum(e[1] for e in evicted.values())
+
+    def invalidate(self, owner):
+        with self._lock:
+            self.invalidations += 1
+            if owner in self._generations:
+                self._generations[owner] += 1
+            entries = self._data.pop(owner, None)
+            if entries:
+                self.bytes -= sum(e[1] for e in entries.values())
+
+    def invalidate_many(self, owners):
+        for owner in set(owners):
+            self.invalidate(owner)
+
+    def clear(self):
+        with self._lock:
+            for owner in self._generations:
+                self._generations[owner] += 1
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = sum(len(e) for e in self._data.values())
+        return {
+            "owners": len(self._data),
+            "entries": entries,
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "approx_bytes": self.bytes,
+        }
@@ -0,0 +1,154 @@
+"""Async HTTP client for calls between services.
+
+One ``ServiceClient`` per downstream service keeps a pool of keep-alive
+connections, bounds every call with a deadline, retries transient failures with
+jittered exponential backoff and trips a circuit breaker when the dependency
+keeps failing, so a slow or dead service fails fast instead of tying up workers.
+
+The underlying ``httpx`` client (and ``httpx`` itself) is only set up on the
+first call, so importing a service or forking a worker doesn't pay for it.
+"""
+import asyncio
+import random
+import time
+
+from shared.metrics import OUTBOUND_LATENCY
+
+
+class ServiceUnavailable(Exception):
+    """The downstream service timed out, errored or its circuit is open."""
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures.
+
+    While open every call is rejected immediately. After ``reset_timeout``
+    seconds one trial call is let through (half-open); its outcome closes the
+    circuit again or re-opens it for another ``reset_timeout``.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_in_flight or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+
+class ServiceClient:
+    """Pooled async client for one downstream service."""
+
+    def __init__(self, base_url, timeout=2.0, retries=2, backoff=0.05,
+                 max_connections=100, max_keepalive=20,
+                 failure_threshold=5, reset_timeout=30.0):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self._client = None
+
+    def _http(self):
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout),
+                # Loading the CA bundle costs tens of ms and plain-http services never use it
+                verify=self.base_url.startswith("https://"),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_keepalive),
+            )
+        return self._client
+
+    async def request(self, method, path, *, deadline=None, retry=None, **kwargs):
+        """Send a request and return the ``httpx.Response``.
+
+        ``deadline`` caps the whole call in seconds, retries included (defaults
+        to the client timeout). Only idempotent methods are retried unless
+        ``retry`` says otherwise. 4xx responses are returned to the caller;
+        timeouts, connection errors and 5xx raise ``ServiceUnavailable``.
+        """
+        if retry is None:
+            retry = method.upper() in ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+        attempts = 1 + (self.retries if retry else 0)
+        try:
+            return await asyncio.wait_for(
+                self._send(method, path, attempts, kwargs),
+                timeout=deadline or self.timeout,
+            )
+        except asyncio.TimeoutError:
+            # The cancelled attempt was already recorded as a failure by _send
+            raise ServiceUnavailable(f"{self.base_url}{path}: deadline exceeded")
+
+    async def _send(self, method, path, attempts, kwargs):
+        import httpx
+        client = self._http()
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                raise ServiceUnavailable(f"{self.base_url}: circuit open")
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+            except httpx.HTTPError as e:
+                OUTBOUND_LATENCY.observe(time.perf_counter() - start, self.base_url, method, type(e).__name__)
+                self.breaker.record_failure()
+                error = f"{self.base_url}{path}: {type(e).__name__}"
+            except BaseException:
+                # Cancelled (e.g. by the deadline) or failed some other way: still
+                # settle the attempt, or a half-open trial would never be let go
+                self.breaker.record_failure()
+                raise
+            else:
+                OUTBOUND_LATENCY.observe(time.perf_counter() - start, self.base_url, method, str(response.status_code))
+                if response.status_code < 500:
+                    self.breaker.record_success()
+                    return response
+                self.breaker.record_failure()
+                error = f"{self.base_url}{path}: HTTP {response.status_code}"
+
+            if attempt + 1 < attempts:
+                # Full jitter keeps retries from many requests from lining up
+                await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+        raise ServiceUnavailable(error)
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
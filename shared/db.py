@@ -0,0 +1,168 @@
+"""Pooled, long-lived SQLite connections shared by all three services.
+
+Opening a connection per request means SQLite re-parses the schema and starts
+with a cold page cache every time. A ``Database`` keeps a bounded pool of
+connections open for the lifetime of the process instead, each configured with
+WAL journaling and the pragmas below, and hands them out to request handlers.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from shared.metrics import observe_query
+
+# Tunables, overridable per deployment through environment variables
+POOL_SIZE = int(os.environ.get("SQLITE_POOL_SIZE", "8"))
+BUSY_TIMEOUT = float(os.environ.get("SQLITE_BUSY_TIMEOUT", "10"))
+SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+CACHE_SIZE = int(os.environ.get("SQLITE_CACHE_SIZE", "-16000"))  # negative = KiB, so ~16 MB
+MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024)))
+STATEMENT_CACHE = int(os.environ.get("SQLITE_STATEMENT_CACHE", "128"))
+
+_SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA", "0", "1", "2", "3"}
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Records how long each statement takes to execute (fetching is not included)"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            observe_query(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            observe_query(sql, time.perf_counter() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors, including the conn.execute() shortcuts, are timed"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class Database:
+    """A bounded pool of SQLite connections to a single database file.
+
+    Use ``with db.connection() as conn:`` in handlers. The connection goes back
+    to the pool afterwards; anything left uncommitted is rolled back first.
+    """
+
+    def __init__(self, path, pool_size=POOL_SIZE, timeout=BUSY_TIMEOUT,
+                 synchronous=SYNCHRONOUS, cache_size=CACHE_SIZE,
+                 mmap_size=MMAP_SIZE, statement_cache=STATEMENT_CACHE):
+        if str(synchronous).upper() not in _SYNCHRONOUS_MODES:
+            raise ValueError(f"Invalid synchronous mode: {synchronous}")
+        self.path = path
+        self.pool_size = max(1, pool_size)
+        self.timeout = timeout
+        self.synchronous = str(synchronous).upper()
+        self.cache_size = int(cache_size)
+        self.mmap_size = int(mmap_size)
+        self.statement_cache = statement_cache
+        # LIFO so the most recently used (warmest) connection is reused first
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self):
+        # cached_statements keeps prepared statements alive on each connection,
+        # so the same SQL text is only compiled once per pooled connection
+        conn = sqlite3.connect(self.path, timeout=self.timeout,
+                               check_same_thread=False,
+                               cached_statements=self.statement_cache,
+                               factory=TimedConnection)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA cache_size={self.cache_size}")
+        conn.execute(f"PRAGMA mmap_size={self.mmap_size}")
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        return conn
+
+    def _acquire(self):
+        if self._closed:
+            raise sqlite3.ProgrammingError("Database has been closed")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.pool_size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        # Pool is at its bound: wait for another request to give one back
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Timed out waiting for a database connection")
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._release(conn)
+
+    @contextmanager
+    def transaction(self, immediate=True):
+        """Borrow a connection and run the block as one transaction.
+
+        ``BEGIN IMMEDIATE`` takes the write lock up front, so concurrent writers
+        queue on the busy timeout instead of failing when a read lock has to be
+        upgraded mid-transaction. Commits on success, rolls back on error.
+        """
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            yield conn
+            conn.commit()
+
+    def close(self):
+        """Close every idle connection. Called from the FastAPI shutdown hook."""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
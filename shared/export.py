@@ -0,0 +1,62 @@
+"""Streaming NDJSON/CSV export of query results.
+
+Rows arrive in fixed-size batches from a repository's ``stream()`` and are
+encoded one batch at a time, so memory use stays flat no matter how large the
+table is. Meant to be wrapped in a ``StreamingResponse``.
+"""
+import csv
+import io
+import json
+
+BATCH_SIZE = 1000
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+class NdjsonEncoder:
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def header(self):
+        return b""
+
+    def encode(self, rows):
+        return "".join(json.dumps(dict(zip(self.columns, row))) + "\n" for row in rows).encode()
+
+
+class CsvEncoder:
+
+    def __init__(self, columns):
+        self.columns = columns
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def header(self):
+        return self.encode([self.columns])
+
+    def encode(self, rows):
+        self._writer.writerows(rows)
+        chunk = self._buffer.getvalue().encode()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return chunk
+
+
+ENCODERS = {
+    "ndjson": NdjsonEncoder,
+    "csv": CsvEncoder,
+}
+
+
+async def stream_batches(batches, columns, fmt):
+    """Yield encoded chunks from an async iterator of row batches (see the repositories' ``stream``)"""
+    encoder = ENCODERS[fmt](columns)
+    header = encoder.header()
+    if header:
+        yield header
+    async for rows in batches:
+        yield encoder.encode(rows)
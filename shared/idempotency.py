@@ -0,0 +1,158 @@
+"""``Idempotency-Key`` support for the services' write endpoints.
+
+A client that may send the same write twice (a Streamlit rerun, a retry after
+a timeout) sets an ``Idempotency-Key`` header. The first request with a given
+key runs normally and its response is remembered; repeats get that stored
+response back without running the handler again, so there is no second
+validation, cross-service call or insert. Duplicates that arrive while the
+first is still running wait for it and share its response instead of racing it.
+
+* Keys are scoped to method and path, and tied to the query string and body:
+  reusing a key for a different request is rejected with 422.
+* Only responses below 500 are stored, so a request that failed on the server
+  can be retried with the same key.
+* The store is per process, bounded and expires entries after a TTL. Writes
+  that must never be duplicated across workers still rely on the database
+  (e.g. the bills' idempotency keys); this removes the wasted work in front.
+* Responses sent from here never reach the router, so the route is matched
+  first and ``/metrics`` files them under their endpoint, not "unmatched".
+"""
+import asyncio
+import hashlib
+import json
+import os
+
+from starlette.routing import Match
+
+from shared.cache import TTLCache
+from shared.metrics import Counter
+
+HEADER = b"idempotency-key"
+REPLAYED_HEADER = b"idempotent-replayed"
+MAX_KEY_LENGTH = 255
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_TTL = float(os.environ.get("IDEMPOTENCY_TTL", "3600"))
+
+# Requests carrying a key, by what happened to them
+IDEMPOTENT_REQUESTS = Counter("idempotent_requests_total", "Requests with an Idempotency-Key, by outcome",
+                              ["outcome"])
+
+_SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+def _match_route(scope):
+    """Set ``scope["route"]`` as the router would have, for responses sent before reaching it"""
+    router = getattr(scope.get("app"), "router", None)
+    for route in getattr(router, "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            scope["route"] = route
+            return
+
+
+class IdempotencyMiddleware:
+    """Pure ASGI middleware; add with ``app.add_middleware(IdempotencyMiddleware)``"""
+
+    def __init__(self, app, maxsize=IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_TTL):
+        self.app = app
+        self.responses = TTLCache(maxsize=maxsize, ttl=ttl)  # key -> (fingerprint, status, headers, body)
+        self._in_flight = {}  # key -> (fingerprint, future done when the first request finishes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in _SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+        idempotency_key = dict(scope["headers"]).get(HEADER)
+        if idempotency_key is None:
+            await self.app(scope, receive, send)
+            return
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            await self._error(scope, send, 400, f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+            return
+
+        # The handler gets the body we read, so it can be fingerprinted first
+        body = await self._read_body(receive)
+        if body is None:
+            return  # client went away
+        fingerprint = hashlib.sha256(scope["query_string"] + b"?" + body).digest()
+        key = (scope["method"], scope["path"], idempotency_key)
+
+        waited = False
+        while True:
+            stored = self.responses.get(key)
+            if stored is not None:
+                if stored[0] != fingerprint:
+                    IDEMPOTENT_REQUESTS.inc("conflict")
+                    await self._error(scope, send, 422, "Idempotency-Key was already used for a different request")
+                    return
+                IDEMPOTENT_REQUESTS.inc("coalesced" if waited else "replayed")
+                await self._replay(scope, send, stored)
+                return
+            running = self._in_flight.get(key)
+            if running is None:
+                break
+            if running[0] != fingerprint:
+                IDEMPOTENT_REQUESTS.inc("conflict")
+                await self._error(scope, send, 422, "Idempotency-Key was already used for a different request")
+                return
+            # Wait for the first request; if it didn't store a response, go again
+            waited = True
+            await asyncio.shield(running[1])
+
+        IDEMPOTENT_REQUESTS.inc("executed")
+        done = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = (fingerprint, done)
+        response = {"status": None, "headers": [], "body": []}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = message.get("headers", [])
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+            await send(message)
+
+        body_sent = False
+        async def receive_body():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        try:
+            await self.app(scope, receive_body, send_wrapper)
+            if response["status"] is not None and response["status"] < 500:
+                self.responses.set(key, (fingerprint, response["status"], response["headers"],
+                                         b"".join(response["body"])))
+        finally:
+            del self._in_flight[key]
+            done.set_result(None)
+
+    @staticmethod
+    async def _read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    @staticmethod
+    async def _replay(scope, send, stored):
+        _match_route(scope)
+        _, status, headers, body = stored
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [*headers, (REPLAYED_HEADER, b"true")]})
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    async def _error(scope, send, status, detail):
+        _match_route(scope)
+        body = json.dumps({"detail": detail}).encode()
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,242 @@
+"""Prometheus-style metrics and an optional sampling profiler for the services.
+
+``instrument(app)`` adds a middleware that records per-route latency and
+in-flight requests, and serves everything in the Prometheus text format on
+``GET /metrics``. ``shared.db`` and ``shared.clients`` record SQLite statement
+timings and outbound HTTP timings into the same registry.
+
+Set ``PROFILER_SAMPLE_INTERVAL`` (seconds, e.g. ``0.01``) to also start a
+sampling profiler; its collapsed stacks are served on ``GET /debug/profile``
+in the format flamegraph tools read.
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter as _StackCounter
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.extend(self._render_value(labels, value))
+        return lines
+
+    def _render_value(self, labels, value):
+        return [f"{self.name}{_format_labels(self.label_names, labels)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # [per-bucket counts..., sum, count]
+                state = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def _render_value(self, labels, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, [('le', '+Inf')])} {state[-1]}")
+        lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {state[-2]}")
+        lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {state[-1]}")
+        return lines
+
+
+REGISTRY = []
+
+HTTP_REQUESTS = Counter("http_requests_total", "Requests handled, by route and status",
+                        ["method", "route", "status"])
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "Time to handle a request, by route",
+                         ["method", "route"])
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being handled")
+DB_QUERY_LATENCY = Histogram("db_query_duration_seconds", "SQLite statement execution time, by statement",
+                             ["statement"])
+OUTBOUND_LATENCY = Histogram("outbound_request_duration_seconds",
+                             "Calls to other services, by target and outcome",
+                             ["target", "method", "outcome"])
+
+_PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def statement_label(sql):
+    """Normalise SQL into a low-cardinality label: one line, IN (?, ?, ...) collapsed"""
+    sql = _WHITESPACE.sub(" ", sql).strip()
+    return _PLACEHOLDER_LIST.sub("?...", sql)[:160]
+
+
+def observe_query(sql, seconds):
+    DB_QUERY_LATENCY.observe(seconds, statement_label(sql))
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streaming responses are timed until their last byte"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_FLIGHT.dec()
+            # The route template ("/bills/{patient_id}"), not the raw path, keeps labels bounded
+            route = scope.get("route")
+            route = getattr(route, "path", "unmatched")
+            HTTP_LATENCY.observe(elapsed, scope["method"], route)
+            HTTP_REQUESTS.inc(scope["method"], route, str(status))
+
+
+class SamplingProfiler:
+    """Samples every thread's stack at a fixed interval and counts collapsed stacks."""
+
+    def __init__(self, interval, max_stacks=10000):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.samples = 0
+        self._stacks = _StackCounter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                self.samples += 1
+                for thread_id, frame in frames.items():
+                    if thread_id == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                        frame = frame.f_back
+                    key = ";".join(reversed(stack))
+                    if key in self._stacks or len(self._stacks) < self.max_stacks:
+                        self._stacks[key] += 1
+
+    def collapsed(self, reset=False):
+        with self._lock:
+            lines = [f"{stack} {count}" for stack, count in self._stacks.most_common()]
+            if reset:
+                self._stacks.clear()
+                self.samples = 0
+        return "\n".join(lines) + "\n"
+
+
+PROFILER_SAMPLE_INTERVAL = float(os.environ.get("PROFILER_SAMPLE_INTERVAL", "0"))
+profiler = None
+
+
+def instrument(app):
+    """Add request metrics, GET /metrics and (if enabled) GET /debug/profile to an app"""
+    from fastapi.responses import PlainTextResponse
+
+    global profiler
+    app.add_middleware(MetricsMiddleware)
+
+    def metrics():
+        return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
+    app.add_api_route("/metrics", metrics, methods=["GET"], include_in_schema=False)
+
+    if PROFILER_SAMPLE_INTERVAL > 0:
+        if profiler is None:
+            profiler = SamplingProfiler(PROFILER_SAMPLE_INTERVAL)
+            profiler.start()
+
+        def profile(reset: bool = False):
+            return PlainTextResponse(profiler.collapsed(reset))
+        app.add_api_route("/debug/profile", profile, methods=["GET"], include_in_schema=False)
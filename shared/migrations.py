@@ -0,0 +1,65 @@
+"""Versioned schema migrations, tracked with SQLite's ``PRAGMA user_version``
+(or a ``schema_versions`` table on PostgreSQL).
+
+Each service keeps an ordered list of SQL scripts in its ``schema.py``. The
+script at index ``i`` upgrades the database to version ``i + 1``. Scripts that
+have already run are skipped, and a database that is already at the latest
+version is recognised with a single read, without taking a write lock or
+running any DDL, so applying migrations on every start is cheap.
+"""
+import sqlite3
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, migrations):
+    """Bring the database up to ``len(migrations)``. Returns the final version."""
+    current = schema_version(conn)
+    if current >= len(migrations):
+        return current
+    for version, script in enumerate(migrations, start=1):
+        if schema_version(conn) >= version:
+            continue
+        try:
+            # executescript runs outside Python's implicit transactions, so the
+            # script and the version bump are wrapped in one explicit transaction
+            conn.executescript(
+                f"BEGIN IMMEDIATE;\n{script}\nPRAGMA user_version = {version};\nCOMMIT;"
+            )
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            # Another worker may have applied this version while we waited for the lock
+            if schema_version(conn) >= version:
+                continue
+            raise
+    return schema_version(conn)
+
+
+async def migrate_postgres(conn, name, migrations):
+    """Bring a service's PostgreSQL schema up to ``len(migrations)``. Returns the final version.
+
+    PostgreSQL has no per-database ``user_version``, and services may share one
+    database, so versions are kept per service name in ``schema_versions``. DDL
+    is transactional there: the whole upgrade runs in one transaction under an
+    advisory lock, so workers starting together apply it exactly once. The lock
+    and the DDL are skipped when the schema is already current.
+    """
+    if await conn.fetchval("SELECT to_regclass('schema_versions') IS NOT NULL"):
+        current = await conn.fetchval("SELECT version FROM schema_versions WHERE name=$1", name) or 0
+        if current >= len(migrations):
+            return current
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext('schema_versions'))")
+        await conn.execute("CREATE TABLE IF NOT EXISTS schema_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        current = await conn.fetchval("SELECT version FROM schema_versions WHERE name=$1", name) or 0
+        for version, script in enumerate(migrations, start=1):
+            if current >= version:
+                continue
+            await conn.execute(script)
+            current = version
+        await conn.execute("""INSERT INTO schema_versions (name, version) VALUES ($1, $2)
+                              ON CONFLICT (name) DO UPDATE SET version = EXCLUDED.version""", name, current)
+    return current
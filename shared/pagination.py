@@ -0,0 +1,31 @@
+"""Helpers for keyset (cursor) pagination and bulk lookups.
+
+List endpoints take ``limit`` and ``after``. When a page comes back full, the
+cursor for the next page is returned in the ``X-Next-Cursor`` response header,
+so the response body keeps its original shape.
+"""
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Bulk endpoints accept at most this many ids per call
+MAX_BULK_IDS = 1000
+# Bulk write endpoints accept at most this many items per call
+MAX_BULK_WRITES = 5000
+# IN (...) lists are split so a query never binds more than this many variables
+IN_CHUNK_SIZE = 500
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def set_next_cursor(response, rows, limit, make_cursor):
+    """Point the client at the next page if this one came back full."""
+    if len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = make_cursor(rows[-1])
+
+
+def placeholders(count):
+    return ", ".join("?" * count)
+
+
+def chunks(items, size=IN_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
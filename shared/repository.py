@@ -0,0 +1,113 @@
+"""Storage backends behind each service's repository.
+
+Every service keeps its SQL in a ``repository.py`` with two implementations of
+the same async interface:
+
+* SQLite (the default): a pooled ``Database`` file next to the service. The
+  queries are blocking, so each repository method runs on the threadpool.
+* PostgreSQL, via an asyncpg connection pool, selected by setting the
+  service's ``*_DATABASE_URL`` to a ``postgresql://`` URL. Unlike one SQLite
+  file, it takes any number of uvicorn workers or hosts per service without
+  writers queueing on a single file lock.
+
+Handlers only ever talk to the repository, so both backends serve identical
+responses; ``scripts/check_repositories.py`` runs the same checks against each.
+"""
+import functools
+import os
+
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from shared.db import Database
+from shared.migrations import migrate, migrate_postgres
+
+PG_POOL_MIN = int(os.environ.get("PG_POOL_MIN", "1"))
+PG_POOL_MAX = int(os.environ.get("PG_POOL_MAX", "10"))
+
+
+def is_postgres_url(url):
+    return bool(url) and url.startswith(("postgres://", "postgresql://"))
+
+
+def blocking(method):
+    """Turn a blocking SQLite method into a coroutine that runs it on the threadpool"""
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        return await run_in_threadpool(method, self, *args, **kwargs)
+    return wrapper
+
+
+class SqliteRepository:
+    """Base for the SQLite repositories: owns the connection pool and its schema"""
+
+    def __init__(self, path, migrations, **db_options):
+        self.db = Database(path, **db_options)
+        self.migrations = migrations
+
+    async def open(self):
+        await run_in_threadpool(self._migrate)
+
+    def _migrate(self):
+        with self.db.connection() as conn:
+            migrate(conn, self.migrations)
+
+    async def close(self):
+        self.db.close()
+
+    def _stream(self, sql, params, batch_size):
+        with self.db.connection() as conn:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+    def stream(self, sql, params, batch_size):
+        """Rows of a query in batches, fetched on the threadpool as they're consumed"""
+        return iterate_in_threadpool(self._stream(sql, params, batch_size))
+
+
+class PostgresRepository:
+    """Base for the PostgreSQL repositories: owns the asyncpg pool and its schema.
+
+    The pool has to be created inside the running event loop, so it is opened
+    from the FastAPI lifespan handler rather than at import time.
+    """
+
+    def __init__(self, url, name, migrations, min_size=PG_POOL_MIN, max_size=PG_POOL_MAX, **pool_options):
+        self.url = url
+        self.name = name
+        self.migrations = migrations
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool_options = pool_options
+        self.pool = None
+
+    async def open(self):
+        # Imported here so SQLite-only deployments don't need asyncpg installed
+        import asyncpg
+
+        self.pool = await asyncpg.create_pool(self.url, min_size=self.min_size, max_size=self.max_size,
+                                              **self.pool_options)
+        async with self.pool.acquire() as conn:
+            await migrate_postgres(conn, self.name, self.migrations)
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+
+    async def stream(self, sql, params, batch_size):
+        """Rows of a query in batches, read through a server-side cursor.
+
+        The cursor runs in one read-only REPEATABLE READ transaction, so a long
+        export sees a consistent snapshot while writers carry on.
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                cursor = await conn.cursor(sql, *params)
+                while True:
+                    rows = await cursor.fetch(batch_size)
+                    if not rows:
+                        break
+                    yield [tuple(r) for r in rows]